@@ -7,29 +7,20 @@
 # policing/simulation/run-predpol/
 
 
+import argparse
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.stats as dist
-import random
-import array
-import pylab
-import pickle
-import random
 import pandas as pd
-import datetime
-import scipy
-import copy
-import sys
-import predpol as pp
-import sys
+import eventcache as ec
+from simulation import Simulation, day_number
 assert sys.version_info.major == 3
-import argparse
 
 #tv_rds = r.readRDS("../output/crimes_by_bin_drugs.rds")
 
 ## ------------ define functions ----------------------##
 #function to take stuff in from makefile
-def getargs():
+def getargs(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--drug_crimes_with_bins", required=True)
     parser.add_argument("--global_start", required=True)
@@ -40,147 +31,233 @@ def getargs():
     parser.add_argument("--begin_predpol", required=True)
     parser.add_argument("--add_crimes_logical", required=True)
     parser.add_argument("--percent_increase", required=True)
+    parser.add_argument("--warm_start", action="store_true",
+                        help="start every day's EM from the previous day's "
+                             "fit instead of from scratch, and run it until "
+                             "every parameter settles")
+    parser.add_argument("--accelerate", action="store_true",
+                        help="use SQUAREM-accelerated EM")
+    parser.add_argument("--max_iter", type=int, default=None,
+                        help="cap on EM steps per day")
+    parser.add_argument("--em_iterations", default=None,
+                        help="optional csv of EM iterations and seconds "
+                             "per day")
+    parser.add_argument("--formats", nargs='+', default=['csv'],
+                        choices=['csv', 'npz', 'parquet'],
+                        help="what to write the predictions and observed "
+                             "counts as; parquet needs pyarrow")
+    parser.add_argument("--log", default=None,
+                        help="optional json-lines file of per-day timings, "
+                             "EM iterations, window sizes and memory")
+    parser.add_argument("--profile", default=None,
+                        help="run under cProfile and write its stats here, "
+                             "for pstats or snakeviz")
+    parser.add_argument("--neighbors", default=None,
+                        help="csv of bin centroids (bin, x, y); fit the "
+                             "model with triggering between bins within "
+                             "--radius of each other")
+    parser.add_argument("--radius", type=float, default=None)
+    parser.add_argument("--checkpoint", default=None,
+                        help="save the simulation's state here as it goes")
+    parser.add_argument("--checkpoint_every", type=int, default=30,
+                        help="days between checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on from --checkpoint, if it exists")
+    parser.add_argument("--cache_dir", default=None,
+                        help="keep the parsed event table here, keyed by "
+                             "the input's hash, for later runs to reuse")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="fit the days in this many processes at once; "
+                             "only without added crimes or --warm_start")
+
+    return parser.parse_args(argv)
+
+
+def output_locations(args, add_crimes_logical, percent_increase):
+	''' the csv paths for the predictions and the observed counts '''
+	#define where to output simulation results
+	output_location_predictions = args.predictions #'output/predpol_drug_predictions'
+	output_location_observed = args.observed #'output/predpol_drug_observed'
+
+	if add_crimes_logical:
+		output_location_predictions += '_add_' + str(int(percent_increase*100)) + 'percent.csv'
+	else:
+		output_location_predictions += '.csv'
+
+	if add_crimes_logical:
+		output_location_observed += '_add_' + str(int(percent_increase*100)) + 'percent.csv'
+	else:
+		output_location_observed += '.csv'
+	return(output_location_predictions, output_location_observed)
+
+
+def write_results(results, output_location_predictions,
+		output_location_observed, formats=('csv',)):
+	''' write the rates and observed counts of run_predpol to the .csv
+	    locations, and/or next to them as .npz or .parquet. the .npz
+	    holds the two bins x days matrices and their bins and dates '''
+	rates, observed = results['rates'], results['observed']
+	base_predictions = output_location_predictions[:-len('.csv')]
+	base_observed = output_location_observed[:-len('.csv')]
+	if 'csv' in formats:
+		rates.to_csv(output_location_predictions)
+		observed.to_csv(output_location_observed)
+	if 'npz' in formats:
+		for base, frame in [(base_predictions, rates),
+				(base_observed, observed)]:
+			np.savez(base + '.npz', values=frame.values,
+				bins=frame.index.values,
+				dates=frame.columns.values.astype(str))
+	if 'parquet' in formats:
+		#column names are the dates, already strings
+		rates.to_parquet(base_predictions + '.parquet')
+		observed.to_parquet(base_observed + '.parquet')
+
+
+def run_predpol(bins, days, max_bin, global_start, global_end, predpol_window,
+		begin_predpol=0, add_crimes_logical=False, percent_increase=0.0,
+		warm_start=False, accelerate=False, max_iter=None,
+		rng=np.random, verbose=True, log=None, checkpoint=None,
+		checkpoint_every=30, resume=False, graph=None, workers=1,
+		index=None, daily_counts=None):
+	''' the daily predpol simulation over the events (bins[i], days[i]),
+	    day numbers already limited to [global_start, global_end].
+	    rng draws the added crimes: np.random by default, or a
+	    np.random.Generator for reproducible replicates. log is a file
+	    for the per-day json lines of Simulation. with a checkpoint path
+	    the simulation is saved there every checkpoint_every days, and
+	    with resume it picks up from there when the file exists; a
+	    checkpoint saved with other settings is a ValueError. graph,
+	    a spatial.NeighborGraph, switches to the spatial model. with
+	    workers > 1, no crimes added and no warm start, the days are fit
+	    by that many processes at once (see parallel.run). index and
+	    daily_counts, already built from the events, go to Simulation.
+	    returns dict(rates, observed, em_iterations) as DataFrames, and
+	    targeted: the number of days each bin 0..max_bin was in the top k '''
+
+	if resume and checkpoint is not None and os.path.exists(checkpoint):
+		sim = Simulation.load(checkpoint, log=log, verbose=verbose)
+		#the checkpoint carries on its own run, not the one asked for
+		settings = dict(max_bin=max_bin, global_start=global_start,
+			global_end=global_end, predpol_window=predpol_window,
+			begin_predpol=begin_predpol,
+			add_crimes_logical=add_crimes_logical,
+			percent_increase=percent_increase, warm_start=warm_start,
+			accelerate=accelerate, max_iter=max_iter)
+		differ = ['{}={!r} (given {!r})'.format(name, getattr(sim, name),
+			value) for name, value in settings.items()
+			if getattr(sim, name) != value]
+		if (sim.graph is None) != (graph is None):
+			differ.append('graph')
+		if differ:
+			raise ValueError(checkpoint + ' was saved with other '
+				'settings: ' + ', '.join(differ))
+		if verbose:
+			print("resuming at day " + str(sim.i))
+	else:
+		sim = Simulation(bins, days, max_bin, global_start, global_end,
+			predpol_window, begin_predpol=begin_predpol,
+			add_crimes_logical=add_crimes_logical,
+			percent_increase=percent_increase, warm_start=warm_start,
+			accelerate=accelerate, max_iter=max_iter, rng=rng,
+			verbose=verbose, log=log, graph=graph, index=index,
+			daily_counts=daily_counts)
+	if workers > 1:
+		import parallel
+		return(parallel.run(sim, workers).results())
+	return(sim.run(checkpoint=checkpoint, every=checkpoint_every).results())
+
+
+def main(argv=None):
+	args = getargs(argv)
+	#fail now rather than after the run if parquet can't be written
+	if 'parquet' in args.formats:
+		import pyarrow
+
+	## ------------ load data -----------------------------------##
+	#load data, as bins and day numbers
+	bins, days = ec.load_events(args.drug_crimes_with_bins, args.cache_dir)
+
+
+	## ---------- set parameters of run-------------------------##
+	#define dates to be usued
+	global_start = pd.to_datetime(args.global_start) #2011/01/01
+	global_end = pd.to_datetime(args.global_end) #2011/12/31
+	begin_predpol = int(args.begin_predpol)#90
+
+	#define length of sliding window to be used in predpol
+	predpol_window = int(args.predpol_window)
+
+	#define whether we'll be adding c rimes
+	add_crimes_logical = args.add_crimes_logical == 'True'
+
+	#if we're adding crimes, how much?
+	percent_increase = float(args.percent_increase) #.5
+
+	output_location_predictions, output_location_observed = \
+		output_locations(args, add_crimes_logical, percent_increase)
+
+
+	# define how many bins are needed for dataframe
+	max_bin = int(bins.max())
+	print("max bins is: " + str(max_bin))
+
+	#print some stuff
+	print(len(bins))
+	keep = (days >= day_number(global_start)) & (days <= day_number(global_end))
+	bins, days = bins[keep], days[keep]
+	print(len(bins))
+
+	graph = None
+	if args.neighbors is not None:
+		assert args.radius is not None, '--neighbors needs --radius'
+		import spatial as sp
+		graph = sp.NeighborGraph.from_csv(args.neighbors, args.radius)
+
+	#the days only run apart when none depends on the one before
+	if args.workers > 1:
+		assert not add_crimes_logical, '--workers needs no added crimes'
+		assert args.log is None and args.checkpoint is None, \
+			'--workers runs without --log or --checkpoint'
+		#and a warm start ties each day to the fit of the one before
+		assert not args.warm_start, '--workers needs cold starts'
+
+	#a resumed run adds to the log of the run it carries on, from the
+	#checkpoint's day (see Simulation.load)
+	log_mode = 'a+' if args.resume else 'w'
+	log = open(args.log, log_mode) if args.log is not None else None
+	#the optional parts are only imported when asked for
+	profile = None
+	if args.profile is not None:
+		import cProfile
+		profile = cProfile.Profile()
+		profile.enable()
+	results = run_predpol(bins, days, max_bin,
+		global_start, global_end, predpol_window,
+		begin_predpol=begin_predpol,
+		add_crimes_logical=add_crimes_logical,
+		percent_increase=percent_increase,
+		#each day's fit starts from scratch unless told otherwise
+		warm_start=args.warm_start,
+		accelerate=args.accelerate, max_iter=args.max_iter, log=log,
+		checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every,
+		resume=args.resume, graph=graph, workers=args.workers)
+	if profile is not None:
+		profile.disable()
+		profile.dump_stats(args.profile)
+	if log is not None:
+		log.close()
+
+	#output results
+	write_results(results, output_location_predictions,
+		output_location_observed, args.formats)
+
+	em_iterations = results['em_iterations']
+	print("total EM iterations: " + str(em_iterations.iterations.sum()))
+	print("total EM seconds: " + str(em_iterations.seconds.sum()))
+	if args.em_iterations is not None:
+		em_iterations.to_csv(args.em_iterations)
 
-    return parser.parse_args()
-
-
-#define function to set up data for run
-def prepare_data_for_predpol(data, start_time, end_time):
-
-	data = data[(data.DateTime >= start_time) & (data.DateTime < end_time)]
-	pp_dict = dict((int(i), []) for i in set(data.bin))
-
-	for i in data.index:
-		pp_dict[int(data.bin[i])].append(data['DateTime'].loc[i])
-
-	keys_to_drop = []
-	pp_dict = {n: sorted(v) for n,v in pp_dict.items()}
-	for n in pp_dict.keys():
-		if len(pp_dict[n]) < 1:
-			keys_to_drop.append(n)
-
-	for key in keys_to_drop:
-		pp_dict.pop(key, None)
-
-	return(pp_dict)
 
 if __name__ == '__main__':
-    args = getargs()
-
-
-## ------------ load data -----------------------------------##
-#load data
-data = pd.read_csv(args.drug_crimes_with_bins)
-data.columns = ['rownum', 'bin', 'OCCURRED', 'LAG']
-data = data[pd.notnull(data['bin'])]
-data['DateTime'] = pd.to_datetime(data.OCCURRED, format = '%m/%d/%y')
-
-
-## ---------- set parameters of run-------------------------##
-#define dates to be usued
-global_start = pd.to_datetime(args.global_start) #2011/01/01
-global_end = pd.to_datetime(args.global_end) #2011/12/31
-begin_predpol = int(args.begin_predpol)#90
-
-#define length of sliding window to be used in predpol
-predpol_window = int(args.predpol_window)
-
-#define whether we'll be adding c rimes
-if args.add_crimes_logical == 'True':
-	add_crimes_logical = True
-else: 
-	add_crimes_logical = False
-
-#if we're adding crimes, how much?
-percent_increase = float(args.percent_increase) #.5
-
-
-#define where to output simulation results
-output_location_predictions = args.predictions #'output/predpol_drug_predictions'
-output_location_observed = args.observed #'output/predpol_drug_observed'
-
-if add_crimes_logical:
-	output_location_predictions += '_add_' + str(int(percent_increase*100)) + 'percent.csv'
-else:
-	output_location_predictions += '.csv'
-
-if add_crimes_logical:
-	output_location_observed += '_add_' + str(int(percent_increase*100)) + 'percent.csv'
-else:
-	output_location_observed += '.csv'
-
-
-# define how many bins are needed for dataframe
-max_bin = max(data.bin)
-print("max bins is: " + str(max_bin))
-
-#print some stuff
-print(len(data))
-data = data[(data.DateTime >= global_start) & (data.DateTime <= global_end)]
-print(len(data))
-
-
-## ----------- initialize objects to hold outputs -----------------##
-num_predictions = (global_end - global_start).days - predpol_window
-
-#make things for output
-results_rates = pd.DataFrame()
-results_rates['bin'] = range(1, int(max_bin+1))
-results_rates = results_rates.set_index(['bin'])
-
-#num_crimes_per_bin
-results_num_crimes = pd.DataFrame()
-results_num_crimes['bin'] = range(1, int(max_bin+1))
-results_num_crimes = results_num_crimes.set_index(['bin'])
-
-
-## ------------ run predpol -------------------------------------##
-#run predpol iteratively
-for i in range(num_predictions):
-	print(i)
-	start_date = global_start + pd.DateOffset(i)
-	end_date = global_start + pd.DateOffset(i + predpol_window)
-	pp_dict = prepare_data_for_predpol(data, start_date, end_date)
-	r,o, om, thet = pp.runEM(pp_dict, predpol_window, end_date)
-
-	# save rates
-	str_date = str(end_date).split(' ')[0]
-	results_rates[str_date] = 0
-	keys = list(pp_dict.keys())
-	#print(len(keys))
-	#print(len(r))
-	results_rates.loc[keys, str_date] = r
-
-
-	#add p% crimes if that's what we're doing
-	if add_crimes_logical and i >= begin_predpol:
-		crime_today = pd.value_counts(data[data.DateTime==end_date].bin)
-		crime_today_predicted = crime_today.loc[o]
-		crime_today_predicted[pd.isnull(crime_today_predicted)] = 0
-
-
-		add_crimes = np.random.binomial(list(crime_today_predicted + 1) , percent_increase)
-		new_crimes = pd.DataFrame()
-		new_crimes['bin'] = np.repeat(list(crime_today_predicted.index), add_crimes)
-		new_crimes['DateTime'] = end_date
-		new_crimes['OCCURRED'] = end_date
-		new_crimes['LAG'] = 0
-		new_crimes.index = range(1 + max(data.index), 1 + max(data.index) + sum(add_crimes))
-		data = data.append(new_crimes)
-		print(len(data))
-
-		#also need to record the total number of crimes per day
-	crime_today = pd.value_counts(data[data.DateTime==end_date].bin)
-	results_num_crimes[str_date] = 0
-	results_num_crimes.loc[crime_today.index, str_date] = list(crime_today)
-
-	#remove old data to speed things up!
-	data = data[(data.DateTime >= start_date)]
-
-
-
-
-
-#output results
-results_rates.to_csv(output_location_predictions)
-results_num_crimes.to_csv(output_location_observed)
\ No newline at end of file
+	main()
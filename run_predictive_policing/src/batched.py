@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# R replicates of the feedback simulation stepped together in one process.
+# each replicate's bins get labels of their own, replicate * (max_bin + 1)
+# + bin, so the events of all of them sit in one EventIndex: the window
+# of a day is one call for every replicate, the EM is one fitEM_batch, and
+# the ranking and the added crimes are array ops over a leading replicate
+# axis. a replicate does little work per python call; this way the calls
+# are shared.
+#
+
+import numpy as np
+import pandas as pd
+import predpol as pp
+import eventstore as es
+from counts import DailyCounts
+from simulation import day_number
+
+
+def split(store, sets, num_sets):
+    ''' the stores of each set (sets[b] is the set of bin b, in order) '''
+    bounds = np.searchsorted(sets, np.arange(num_sets + 1))
+    out = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        offsets = store.offsets[first:last + 1]
+        out.append(es.EventStore(store.keys[first:last],
+                                 store.days[offsets[0]:offsets[-1]],
+                                 offsets - offsets[0]))
+    return out
+
+
+class BatchedSimulation(object):
+    ''' `replicates` trajectories of Simulation with add_crimes_logical
+        set, over the same events, advanced a day at a time together.
+        replicate r is the Simulation that draws its added crimes from
+        row r of rng.binomial's (replicates, k) draws: one call a day
+        for all of them, so the trajectories depend on rng and on the
+        number of replicates, not on a generator each.
+
+        rate_sum -- rates summed over replicates, bins 0..max_bin by day
+        targeted -- (replicates, max_bin + 1) days each bin was in the top k
+        added    -- (replicates, max_bin + 1) crimes added to each bin
+        iterations -- (replicates, days) EM iterations
+    '''
+
+    def __init__(self, bins, days, max_bin, global_start, global_end,
+                 predpol_window, replicates, begin_predpol=0,
+                 percent_increase=0.0, warm_start=False, k=20,
+                 engine='matrix', max_iter=None, rng=None, verbose=False):
+        self.max_bin = int(max_bin)
+        self.global_start = global_start
+        self.predpol_window = predpol_window
+        self.replicates = replicates
+        self.begin_predpol = begin_predpol
+        self.percent_increase = percent_increase
+        self.warm_start = warm_start
+        self.k = k
+        self.engine = engine
+        self.max_iter = max_iter
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.verbose = verbose
+
+        # t every replicate starts from a copy of the events
+        self.width = self.max_bin + 1
+        bins = np.asarray(bins, dtype=np.int64)
+        labels = (np.arange(replicates)[:, np.newaxis] * self.width +
+                  bins[np.newaxis, :])
+        self.index = es.EventIndex(labels.ravel(), np.tile(days, replicates))
+        # t the crimes on a day before any are added to it: the same for
+        # t every replicate, since a day gets its crimes only once
+        self.daily_counts = DailyCounts(
+            bins, days, self.max_bin, day_number(global_start),
+            (global_end - global_start).days + 1)
+
+        self.num_predictions = ((global_end - global_start).days -
+                                predpol_window)
+        self.i = 0
+        self.omega = np.ones(replicates)
+        self.theta = np.ones(replicates)
+        # t dense over (replicate, bin); 1 is runEM's mu_init
+        self.mu = np.ones((replicates, self.width))
+        first = global_start + pd.DateOffset(predpol_window)
+        self.dates = [str(first + pd.DateOffset(i)).split(' ')[0]
+                      for i in range(self.num_predictions)]
+        self.rate_sum = np.zeros((self.width, self.num_predictions))
+        self.targeted = np.zeros((replicates, self.width), dtype=np.int64)
+        self.added = np.zeros((replicates, self.width), dtype=np.int64)
+        self.iterations = np.zeros((replicates, self.num_predictions),
+                                   dtype=np.int64)
+
+    @property
+    def done(self):
+        return self.i >= self.num_predictions
+
+    def rank(self, sets, keys, rates):
+        ''' the top k bins of every replicate, as pp.top_k ranks them, in a
+            (replicates, k) array, and which of those are real: a
+            replicate with fewer than k bins has fewer
+        '''
+        score = np.full((self.replicates, self.width), -np.inf)
+        score[sets, keys] = rates
+        bins = np.broadcast_to(np.arange(self.width), score.shape)
+        # t highest rate first, ties to the larger bin
+        top = np.lexsort((bins, score))[:, ::-1][:, :self.k]
+        return top, np.isfinite(np.take_along_axis(score, top, axis=1))
+
+    def step(self):
+        ''' simulate day i in every replicate and move on to the next '''
+        i = self.i
+        start_day = day_number(self.global_start + pd.DateOffset(i))
+        end_day = start_day + self.predpol_window
+        store = self.index.window(start_day, end_day)
+        sets = store.keys // self.width
+        keys = store.keys % self.width
+        stores = split(es.EventStore(keys, store.days, store.offsets),
+                       sets, self.replicates)
+        if not self.warm_start:
+            self.omega[:] = 1.0
+            self.theta[:] = 1.0
+            self.mu[:] = 1.0
+        omega, theta, mu, info = pp.fitEM_batch(
+            stores, self.predpol_window, self.omega, self.theta,
+            [self.mu[r, s.keys] for r, s in enumerate(stores)],
+            engine=self.engine, max_iter=self.max_iter,
+            strict=self.warm_start and i > 0)
+        self.omega = np.array(omega)
+        self.theta = np.array(theta)
+        mu = np.concatenate(mu)
+        # t bins out of the window start from mu_init again tomorrow
+        self.mu[:] = 1.0
+        self.mu[sets, keys] = mu
+        self.iterations[:, i] = [d['iterations'] for d in info]
+
+        # t pp.calc_rates, with the kernel of each bin's replicate
+        event_set = sets[store.segment_ids()]
+        epart = np.exp(-self.omega[event_set] * (end_day - store.days))
+        rates = mu + (self.theta[sets] * self.omega[sets] *
+                      np.add.reduceat(epart, store.starts))
+        np.add.at(self.rate_sum[:, i], keys, rates)
+        top, real = self.rank(sets, keys, rates)
+        rows = np.broadcast_to(np.arange(self.replicates)[:, np.newaxis],
+                               top.shape)
+        np.add.at(self.targeted, (rows[real], top[real]), 1)
+        if self.verbose:
+            print(i, self.iterations[:, i].max())
+
+        if i >= self.begin_predpol:
+            extra = self.rng.binomial(self.daily_counts.on(top, end_day) + 1,
+                                      self.percent_increase)
+            extra[~real] = 0
+            np.add.at(self.added, (rows, top), extra)
+            labels = (rows * self.width + top).ravel()
+            self.index.add(np.repeat(labels, extra.ravel()),
+                           np.repeat(end_day, extra.sum()))
+        self.i += 1
+
+    def run(self, until=None):
+        ''' step through day until - 1, or to the end '''
+        if until is None:
+            until = self.num_predictions
+        while self.i < min(until, self.num_predictions):
+            self.step()
+        return self
+
+    def observed(self):
+        ''' (replicates, max_bin + 1): the crimes on the days simulated so
+            far, added crimes included
+        '''
+        first_end = day_number(self.global_start) + self.predpol_window
+        real = self.daily_counts.between(first_end, first_end + self.i)
+        return real.sum(axis=1)[np.newaxis, :] + self.added
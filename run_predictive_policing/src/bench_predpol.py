@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# how the EM's pieces scale: times calc_tij, calc_pij, estep, mstep and
+# lambdafun (and whole runEM fits per engine) on the event patterns of
+# test_predpol's cases, over a grid of bin counts and events per bin, with
+# the peak memory of each. results go to json, and a second run can be
+# compared against the first: steps more than --threshold slower are
+# flagged, and the run exits nonzero.
+#
+# python bench_predpol.py --output bench.json --bins 50 500 \
+#     --events 2 20 200 --compare old_bench.json
+#
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import predpol as pp
+import test_predpol as tp
+assert sys.version_info.major == 3
+
+START = np.datetime64('2012-01-01')
+
+
+## ------------ scenarios --------------------------------------##
+# t the event patterns of test_predpol's cases, sized by num_bins and n
+# t events per bin; each gives dict[bin] -> sorted day shifts from START
+SCENARIOS = dict(even=tp.even_shifts, rough=tp.rough_shifts,
+                 uneven=tp.uneven_shifts, clustered=tp.clustered_shifts)
+
+
+def scenario_data(scenario, num_bins, n, rng):
+    ''' dict[bin] -> sorted datetime64[D] array, like the crime_data of
+        the matching test_predpol case
+    '''
+    shifts = SCENARIOS[scenario](num_bins, n, rng)
+    return dict((i, START + np.asarray(v, dtype='timedelta64[D]'))
+                for i, v in shifts.items())
+
+
+## ------------ measuring --------------------------------------##
+def measure(fn, repeat):
+    ''' best wall time of repeat calls, the peak bytes allocated by one,
+        and its return value
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, out
+
+
+def run_case(scenario, num_bins, n, engines=('matrix',), repeat=3,
+             max_iter=50, max_bytes=2 << 30, seed=0):
+    ''' the records for one scenario at one size: one per step timed, each
+        dict(scenario, bins, events, function, seconds, peak_bytes), or
+        with skipped in place of the timings when the lag matrices would
+        need more than max_bytes.
+    '''
+    data = scenario_data(scenario, num_bins, n,
+                         np.random.RandomState(seed))
+    case = dict(scenario=scenario, bins=num_bins, events=n,
+                num_events=int(sum(len(v) for v in data.values())))
+    # t calc_tij, calc_pij and estep each hold a bins x n x n float64
+    dense = 8 * sum((len(v) - 1) ** 2 for v in data.values())
+    if 4 * dense > max_bytes:
+        return [dict(case, function='all',
+                     skipped='lag matrices need {} bytes'.format(4 * dense))]
+
+    last = max(v[-1] for v in data.values())
+    T = int((last - START).astype(int)) + 1
+    pred = last + np.timedelta64(1, 'D')
+    theta, omega = 0.5, 1.0
+    mu = dict((b, 1.0) for b in data)
+    tij = pp.calc_tij(data)
+    pij, pj = pp.estep(data, mu, theta, omega, tij)
+    steps = [
+        ('calc_tij', lambda: pp.calc_tij(data)),
+        ('calc_pij', lambda: pp.calc_pij(tij, theta, omega)),
+        ('estep', lambda: pp.estep(data, mu, theta, omega, tij)),
+        ('mstep', lambda: pp.mstep(pij, pj, tij, data, T)),
+        # t one bin at a time, as the rates were computed before calc_rates
+        ('lambdafun', lambda: [pp.lambdafun(np.append(data[b], pred),
+                                            mu[b], theta, omega)
+                               for b in data]),
+    ]
+    for engine in engines:
+        steps.append(('runEM[{}]'.format(engine),
+                      lambda engine=engine: pp.runEM(
+                          data, T, pred, engine=engine, max_iter=max_iter,
+                          full_output=True)))
+
+    records = []
+    for name, fn in steps:
+        seconds, peak, out = measure(fn, repeat)
+        record = dict(case, function=name, seconds=seconds,
+                      peak_bytes=peak)
+        if name.startswith('runEM'):
+            record['iterations'] = out[4]['iterations']
+        records.append(record)
+    return records
+
+
+def environment():
+    ''' what the numbers were measured on '''
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(commit=commit, python=platform.python_version(),
+                numpy=np.__version__, machine=platform.machine(),
+                when=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def compare(records, baseline):
+    ''' (record key, old seconds, new seconds) for the steps in both '''
+    def key(r):
+        return (r['scenario'], r['bins'], r['events'], r['function'])
+    old = dict((key(r), r['seconds']) for r in baseline if 'seconds' in r)
+    return [(key(r), old[key(r)], r['seconds']) for r in records
+            if 'seconds' in r and key(r) in old]
+
+
+def regressions(compared, threshold):
+    ''' the compared steps that got slower by more than threshold, as a
+        fraction of the old time
+    '''
+    return [(key, old, new) for key, old, new in compared
+            if new > old * (1 + threshold)]
+
+
+## ------------ command line -----------------------------------##
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", required=True,
+                        help="where to write the json results")
+    parser.add_argument("--scenarios", nargs='+', default=sorted(SCENARIOS),
+                        choices=sorted(SCENARIOS))
+    parser.add_argument("--bins", nargs='+', type=int,
+                        default=[50, 500, 5000, 50000])
+    parser.add_argument("--events", nargs='+', type=int,
+                        default=[2, 20, 200, 2000, 5000])
+    parser.add_argument("--engines", nargs='+', default=['matrix'])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max_iter", type=int, default=50,
+                        help="cap on EM steps in the runEM timings")
+    parser.add_argument("--max_bytes", type=int, default=2 << 30,
+                        help="skip sizes whose lag matrices need more")
+    parser.add_argument("--compare", default=None,
+                        help="an earlier --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="with --compare, the fraction slower a step "
+                        "can get before it counts as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = getargs()
+    records = []
+    for scenario in args.scenarios:
+        for num_bins in args.bins:
+            for n in args.events:
+                for record in run_case(scenario, num_bins, n, args.engines,
+                                       args.repeat, args.max_iter,
+                                       args.max_bytes):
+                    records.append(record)
+                    print(json.dumps(record))
+    with open(args.output, 'w') as f:
+        json.dump(dict(environment=environment(), results=records), f,
+                  indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        compared = compare(records, baseline)
+        slower = regressions(compared, args.threshold)
+        for key, old, new in compared:
+            print('{:<50} {:10.4f}s {:10.4f}s {:6.2f}x{}'.format(
+                ' '.join(str(k) for k in key), old, new, old / new,
+                '  REGRESSION' if (key, old, new) in slower else ''))
+        if slower:
+            sys.exit('{} of {} steps more than {:.0%} slower than {}'.format(
+                len(slower), len(compared), args.threshold, args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# one entry point for the model's jobs. each subcommand imports only the
+# modules it needs, when it runs, so a short job doesn't pay for the
+# others' imports:
+#
+# python cli.py fit --drug_crimes_with_bins=... --end=2011/01/01 \
+#     --predpol_window=180
+# python cli.py simulate <the options of apply_predpol.py>
+# python cli.py sweep <the options of sweep.py>
+# python cli.py startup    # the import time of each, against its budget
+#
+
+import argparse
+import importlib
+import subprocess
+import sys
+import os
+assert sys.version_info.major == 3
+
+# t what each subcommand imports, and the seconds a fresh interpreter may
+# t take to import it before `startup` fails
+MODULES = dict(fit=['eventcache', 'eventstore', 'predpol'],
+               simulate=['apply_predpol'],
+               sweep=['sweep'])
+BUDGET = dict(fit=0.5, simulate=1.5, sweep=1.5)
+
+
+def load(command):
+    ''' import the modules of a subcommand; returns them in order '''
+    return [importlib.import_module(m) for m in MODULES[command]]
+
+
+def fit(argv):
+    ''' fit the window before --end and print its top k bins, highest
+        rate first; --output also writes every bin's rate there as csv
+    '''
+    parser = argparse.ArgumentParser(prog='cli.py fit')
+    parser.add_argument("--drug_crimes_with_bins", required=True)
+    parser.add_argument("--end", required=True,
+                        help="the day predicted; the window ends before it")
+    parser.add_argument("--predpol_window", required=True, type=int)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--engine", default='auto')
+    parser.add_argument("--max_iter", type=int, default=None)
+    parser.add_argument("--cache_dir", default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+    ec, es, pp = load('fit')
+
+    bins, days = ec.load_events(args.drug_crimes_with_bins, args.cache_dir)
+    end = es.to_days([args.end.replace('/', '-')])[0]
+    keep = (days >= end - args.predpol_window) & (days < end)
+    store = es.EventStore.from_arrays(bins[keep], days[keep])
+    rates, tops, omega, theta = pp.runEM(
+        store, args.predpol_window, end.astype('datetime64[D]'), k=args.k,
+        engine=args.engine, max_iter=args.max_iter)
+    print('omega: {} theta: {}'.format(omega, theta))
+    print(' '.join(str(n) for n in tops))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write('bin,rate\n')
+            for n, rate in zip(store.keys.tolist(), rates):
+                f.write('{},{!r}\n'.format(n, rate))
+
+
+def simulate(argv):
+    ''' apply_predpol.py's run '''
+    ap, = load('simulate')
+    ap.main(argv)
+
+
+def sweep(argv):
+    ''' sweep.py's grid of runs '''
+    sw, = load('sweep')
+    sw.main(argv)
+
+
+def import_seconds(command):
+    ''' the time a fresh interpreter takes to import command's modules,
+        and the modules outside the standard library it ends up with
+    '''
+    code = ('import sys, time\n'
+            'started = time.perf_counter()\n'
+            'import cli\n'
+            'cli.load({!r})\n'
+            'print(time.perf_counter() - started)\n'
+            'print(" ".join(sorted(set(m.split(".")[0] '
+            'for m in sys.modules))))').format(command)
+    out = subprocess.check_output(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__))).decode().split('\n')
+    return float(out[0]), out[1].split()
+
+
+def startup(argv):
+    ''' check every subcommand's import time against its budget '''
+    parser = argparse.ArgumentParser(prog='cli.py startup')
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="take the best of this many fresh imports")
+    args = parser.parse_args(argv)
+    over = []
+    for command in sorted(MODULES):
+        seconds = min(import_seconds(command)[0]
+                      for _ in range(args.repeat))
+        print('{:<10} {:6.3f}s  budget {:.1f}s'.format(
+            command, seconds, BUDGET[command]))
+        if seconds > BUDGET[command]:
+            over.append(command)
+    if over:
+        sys.exit('over budget: ' + ' '.join(over))
+
+
+COMMANDS = dict(fit=fit, simulate=simulate, sweep=sweep, startup=startup)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="fit, simulate or sweep the predpol model")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("args", nargs=argparse.REMAINDER,
+                        help="the subcommand's options; see "
+                             "cli.py <command> --help")
+    args = parser.parse_args(argv)
+    COMMANDS[args.command](args.args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# crimes per bin per day, for the observed output and the feedback loop.
+#
+
+import numpy as np
+
+
+class DailyCounts(object):
+    ''' the number of events in every (bin, day), as a dense int matrix.
+
+        counts    -- rows are bin labels 0..max_bin (so row 0 is unused
+                     with Oakland's 1-based bins), columns are days
+        first_day -- the day number of column 0
+    '''
+
+    def __init__(self, bins, days, max_bin, first_day, num_days):
+        bins = np.asarray(bins, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64) - first_day
+        keep = (days >= 0) & (days < num_days)
+        flat = np.bincount(bins[keep] * num_days + days[keep],
+                           minlength=(max_bin + 1) * num_days)
+        self.counts = flat.reshape(max_bin + 1, num_days).astype(np.int32)
+        self.first_day = first_day
+
+    @classmethod
+    def from_counts(cls, counts, first_day):
+        ''' DailyCounts over a copy of another's counts matrix, such as one
+            in shared memory; add() changes only the copy
+        '''
+        daily = cls.__new__(cls)
+        daily.counts = np.array(counts, dtype=np.int32)
+        daily.first_day = first_day
+        return daily
+
+    def column(self, day):
+        return day - self.first_day
+
+    def on(self, bins, day):
+        ''' the counts of the given bins on one day '''
+        return self.counts[np.asarray(bins, dtype=np.int64),
+                           self.column(day)]
+
+    def add(self, bins, day, extra):
+        ''' add extra[i] events to bins[i] on day, in place; repeated bins
+            add up.
+        '''
+        np.add.at(self.counts,
+                  (np.asarray(bins, dtype=np.int64), self.column(day)),
+                  extra)
+
+    def between(self, start, end):
+        ''' the bins x days block for days start <= day < end; a view, so it
+            keeps up with add().
+        '''
+        return self.counts[:, self.column(start):self.column(end)]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# the cleaned event table as int32 arrays, cached on disk by the input
+# file's content so later runs map it instead of parsing the csv again.
+#
+
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# t default cap on the whole cache directory
+MAX_BYTES = 1 << 30
+
+
+def load_table(path):
+    ''' the event table, with unbinned events dropped and dates parsed '''
+    # t here, not at the top: a cache hit needs no pandas
+    import pandas as pd
+    data = pd.read_csv(path)
+    data.columns = ['rownum', 'bin', 'OCCURRED', 'LAG']
+    data = data[pd.notnull(data['bin'])]
+    data['DateTime'] = pd.to_datetime(data.OCCURRED, format='%m/%d/%y')
+    return data
+
+
+def parse_events(path):
+    ''' (bins, days) of the event table as int32 arrays; days are day
+        numbers, days since the epoch
+    '''
+    data = load_table(path)
+    bins = data.bin.values.astype(np.int32)
+    days = np.asarray(data.DateTime.values,
+                      dtype='datetime64[D]').astype(np.int32)
+    return bins, days
+
+
+def file_hash(path, block=1 << 20):
+    ''' sha256 of the file's contents '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name))
+               for name in os.listdir(entry))
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    ''' drop the least recently used entries until the cache directory is
+        within max_bytes; entry keep is never dropped.
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        # t skip half-written entries (dot-prefixed temp dirs) and strays
+        if name.startswith('.') or not os.path.isdir(entry):
+            continue
+        entries.append((os.path.getmtime(entry), entry_size(entry), entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def load_events(path, cache_dir=None, max_bytes=MAX_BYTES):
+    ''' (bins, days) of the event table at path, as int32 arrays.
+
+        with a cache_dir, they are read from the entry for the file's
+        sha256 there as read-only memory maps, after parsing the csv and
+        writing the entry the first time. reading an entry marks it used;
+        writing one evicts the least recently used until the directory
+        holds at most max_bytes.
+    '''
+    if cache_dir is None:
+        return parse_events(path)
+    entry = os.path.join(cache_dir, file_hash(path))
+    if not os.path.isdir(entry):
+        os.makedirs(cache_dir, exist_ok=True)
+        bins, days = parse_events(path)
+        # t write next to the entry, then rename: readers never see a
+        # t partial entry, and of two concurrent writers one wins
+        tmp = tempfile.mkdtemp(prefix='.', dir=cache_dir)
+        np.save(os.path.join(tmp, 'bins.npy'), bins)
+        np.save(os.path.join(tmp, 'days.npy'), days)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        evict(cache_dir, max_bytes, keep=entry)
+    else:
+        os.utime(entry)
+    return (np.load(os.path.join(entry, 'bins.npy'), mmap_mode='r'),
+            np.load(os.path.join(entry, 'days.npy'), mmap_mode='r'))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# packed (CSR-style) storage of event days for all bins at once.
+#
+
+import numpy as np
+
+
+def to_days(events):
+    ''' integer day numbers (days since the epoch) for a list of dates '''
+    return np.asarray(events, dtype='datetime64[D]').astype(np.int64)
+
+
+class EventStore(object):
+    ''' every bin's events in one array, grouped by bin.
+
+        days    -- int32 day numbers, sorted within each bin
+        offsets -- bin b owns days[offsets[b]:offsets[b + 1]]
+        keys    -- the bin label of each segment
+
+        every segment holds at least one event, the same invariant the
+        dict-of-lists input has always had.
+    '''
+
+    def __init__(self, keys, days, offsets):
+        self.keys = np.asarray(keys)
+        self.days = np.asarray(days, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        assert len(self.offsets) == len(self.keys) + 1
+        assert self.offsets[-1] == len(self.days)
+        assert np.all(np.diff(self.offsets) > 0)
+        self._seg = None
+        self._schedule = None
+
+    @classmethod
+    def from_dict(cls, data):
+        ''' pack a dict[bin] -> list of dates; bins keep the dict's order '''
+        assert all([len(v) > 0 for v in data.values()])
+        keys = list(data.keys())
+        counts = [len(data[n]) for n in keys]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        days = np.empty(offsets[-1], dtype=np.int32)
+        for b, n in enumerate(keys):
+            days[offsets[b]:offsets[b + 1]] = np.sort(to_days(data[n]))
+        return cls(keys, days, offsets)
+
+    @classmethod
+    def from_arrays(cls, bins, days):
+        ''' pack parallel arrays of (bin, day) events in any order;
+            bins come out in ascending order.
+        '''
+        bins = np.asarray(bins)
+        days = np.asarray(days)
+        order = np.lexsort((days, bins))
+        bins = bins[order]
+        keys, counts = np.unique(bins, return_counts=True)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        return cls(keys, days[order], offsets)
+
+    @classmethod
+    def concatenate(cls, stores):
+        ''' the bins of several stores one after the other in one store;
+            keys are kept, so they can repeat across stores.
+        '''
+        counts = np.concatenate([s.counts for s in stores])
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        return cls(np.concatenate([s.keys for s in stores]),
+                   np.concatenate([s.days for s in stores]), offsets)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def num_events(self):
+        return len(self.days)
+
+    @property
+    def counts(self):
+        ''' number of events in each bin '''
+        return np.diff(self.offsets)
+
+    @property
+    def starts(self):
+        ''' index of each bin's first event, for np.add.reduceat '''
+        return self.offsets[:-1]
+
+    def segment_ids(self):
+        ''' for every event, the position of its bin in self.keys '''
+        if self._seg is None:
+            self._seg = np.repeat(np.arange(len(self.keys)), self.counts)
+        return self._seg
+
+    def events(self, b):
+        ''' day numbers of the bin at position b '''
+        return self.days[self.offsets[b]:self.offsets[b + 1]]
+
+    def ranks(self):
+        ''' for every event, the number of events before it in its bin '''
+        return np.arange(self.num_events) - self.offsets[self.segment_ids()]
+
+    def rank_schedule(self):
+        ''' event indices grouped by rank: entry k - 1 holds every bin's
+            k-th event (counting from 0), so a recursion over the events of
+            one bin can step all bins at once. rank 0 is left out.
+        '''
+        if self._schedule is None:
+            rank = self.ranks()
+            order = np.argsort(rank, kind='stable')
+            bounds = np.searchsorted(rank[order],
+                                     np.arange(1, rank.max(initial=0) + 2))
+            self._schedule = [order[bounds[k]:bounds[k + 1]]
+                              for k in range(len(bounds) - 1)]
+        return self._schedule
+
+    def day_groups(self):
+        ''' collapse same-day events within each bin: returns an EventStore
+            of each bin's distinct days, and the event count on each day.
+        '''
+        seg = self.segment_ids()
+        first = np.ones(self.num_events, dtype=bool)
+        first[1:] = ((self.days[1:] != self.days[:-1]) |
+                     (seg[1:] != seg[:-1]))
+        idx = np.flatnonzero(first)
+        counts = np.diff(np.append(idx, self.num_events))
+        offsets = np.searchsorted(idx, self.offsets)
+        return EventStore(self.keys, self.days[idx], offsets), counts
+
+    def pairs(self, max_lag=None):
+        ''' every (later event i, earlier event j) pair within a bin with a
+            positive lag, as flat arrays of i and of days[i] - days[j].
+            these are the nonzero cells of calc_tij, all bins together.
+            with max_lag, only the pairs with a lag of at most max_lag: the
+            band of calc_tij near its diagonal, found without the rest.
+        '''
+        if max_lag is not None:
+            return self._band(max_lag)
+        seg = self.segment_ids()
+        # the number of earlier events in the same bin
+        rank = self.ranks()
+        rows = np.repeat(np.arange(self.num_events), rank)
+        pair_starts = np.cumsum(rank) - rank
+        cols = (self.offsets[seg[rows]] +
+                np.arange(len(rows)) - np.repeat(pair_starts, rank))
+        lags = (self.days[rows] - self.days[cols]).astype(np.int64)
+        keep = lags > 0
+        return rows[keep], lags[keep]
+
+    def _band(self, max_lag):
+        if self.num_events == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        days = self.days.astype(np.int64)
+        first = days.min()
+        # t no lag is longer than this, and it keeps the keys small
+        max_lag = int(min(max_lag, days.max() - first))
+        # t sorted (bin, day) keys; a bin's span leaves room for day - max_lag
+        span = days.max() - first + max_lag + 1
+        key = self.segment_ids() * span + (days - first)
+        # t event i pairs with the events of its bin from max_lag days
+        # t before it up to the day before its own
+        lo = np.searchsorted(key, key - max_lag, side='left')
+        hi = np.searchsorted(key, key, side='left')
+        num = hi - lo
+        rows = np.repeat(np.arange(self.num_events), num)
+        pair_starts = np.cumsum(num) - num
+        cols = (np.repeat(lo, num) + np.arange(len(rows)) -
+                np.repeat(pair_starts, num))
+        return rows, days[rows] - days[cols]
+
+
+class EventBuffer(object):
+    ''' events appended in day order, e.g. the crimes the feedback loop
+        adds each day. the arrays double in capacity when they fill up, so
+        n events appended one day at a time are copied O(n) times in all,
+        not O(n) times a day.
+
+        bins, days -- views of the events so far, days non-decreasing
+    '''
+
+    def __init__(self, capacity=256):
+        self._bins = np.empty(capacity, dtype=np.int64)
+        self._days = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def bins(self):
+        return self._bins[:self.size]
+
+    @property
+    def days(self):
+        return self._days[:self.size]
+
+    def append(self, bins, days):
+        ''' add events on days no earlier than any already here '''
+        days = np.asarray(days, dtype=np.int64)
+        n = len(days)
+        if n == 0:
+            return
+        assert np.all(np.diff(days) >= 0), 'days must be in order'
+        assert self.size == 0 or days[0] >= self._days[self.size - 1], \
+            'days must come after the ones already added'
+        if self.size + n > len(self._days):
+            capacity = max(2 * len(self._days), self.size + n)
+            for name in ['_bins', '_days']:
+                grown = np.empty(capacity, dtype=np.int64)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self._bins[self.size:self.size + n] = bins
+        self._days[self.size:self.size + n] = days
+        self.size += n
+
+    def bounds(self, start, end):
+        ''' the positions of the events on days start <= day < end '''
+        return tuple(np.searchsorted(self.days, [start, end]))
+
+
+class EventIndex(object):
+    ''' every event, grouped by bin and sorted by day within each bin, so
+        that any window of days is two searchsorted calls away.
+
+        store    -- the EventStore of the events it was built with; bins in
+                    ascending order
+        injected -- an EventBuffer of the events add()ed since
+    '''
+
+    def __init__(self, bins, days):
+        self.store = EventStore.from_arrays(bins, days)
+        self.injected = EventBuffer()
+        self._build_key()
+
+    @classmethod
+    def from_store(cls, store):
+        ''' an index over an EventStore whose bins are in ascending order,
+            such as the store of another index, without copying it
+        '''
+        index = cls.__new__(cls)
+        index.store = store
+        index.injected = EventBuffer()
+        index._build_key()
+        return index
+
+    def _build_key(self):
+        # one sorted int64 key: the bin's position, then the day in it
+        store = self.store
+        if store.num_events == 0:
+            self._first = 0
+            self._span = 1
+        else:
+            self._first = int(store.days.min())
+            self._span = int(store.days.max()) - self._first + 1
+        self._base = np.arange(len(store), dtype=np.int64) * self._span
+        self._key = (self._base[store.segment_ids()] +
+                     (store.days.astype(np.int64) - self._first))
+
+    def __len__(self):
+        return self.store.num_events + len(self.injected)
+
+    def bounds(self, start, end):
+        ''' for every bin, the positions in store.days of its first event
+            on or after day start and of its first event on or after end.
+        '''
+        lo = np.clip(start - self._first, 0, self._span)
+        hi = np.clip(end - self._first, 0, self._span)
+        return (np.searchsorted(self._key, self._base + lo),
+                np.searchsorted(self._key, self._base + hi))
+
+    def window(self, start, end, injected=True):
+        ''' an EventStore of the events on days start <= day < end; bins
+            with no events in the window are left out. injected=False
+            leaves out the events add()ed after the index was built.
+        '''
+        lo, hi = self.bounds(start, end)
+        counts = hi - lo
+        keep = counts > 0
+        lo = lo[keep]
+        counts = counts[keep]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        # positions lo[b], lo[b] + 1, ..., hi[b] - 1 for every kept bin
+        idx = (np.arange(offsets[-1]) -
+               np.repeat(offsets[:-1] - lo, counts))
+        real = EventStore(self.store.keys[keep], self.store.days[idx],
+                          offsets)
+        first, last = self.injected.bounds(start, end)
+        if not injected or first == last:
+            return real
+        # t merge in the added events; only the window is re-sorted
+        return EventStore.from_arrays(
+            np.concatenate([np.repeat(real.keys, real.counts),
+                            self.injected.bins[first:last]]),
+            np.concatenate([real.days, self.injected.days[first:last]]))
+
+    def add(self, bins, days):
+        ''' take in more events, e.g. crimes added by the feedback loop, on
+            days no earlier than any added before; the index itself is not
+            rebuilt.
+        '''
+        self.injected.append(bins, days)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# the EM's inner loops as plain loops over the packed arrays of an
+# EventStore, compiled by numba when it can be imported. most bins have a
+# handful of events, and one compiled pass over all of them beats many
+# small numpy calls. predpol uses these only when ENABLED, and its numpy
+# code otherwise.
+#
+# numba writes the compiled kernels to __pycache__ next to this file
+# (cache=True), so only the first process to use them pays for compiling;
+# set NUMBA_CACHE_DIR where that isn't writable. PREDPOL_JIT=0 in the
+# environment turns the kernels off even with numba installed. numba
+# itself is only imported when a kernel is first called, so importing
+# predpol doesn't pay for it.
+#
+
+import functools
+import importlib.util
+import math
+import os
+import numpy as np
+
+AVAILABLE = importlib.util.find_spec('numba') is not None
+ENABLED = AVAILABLE and os.environ.get('PREDPOL_JIT', '1') != '0'
+
+
+def jit(fn):
+    ''' fn compiled, and cached to disk, on its first call if numba is
+        there; fn if not. py_func is fn either way, as on numba's own.
+    '''
+    if not AVAILABLE:
+        return fn
+    compiled = []
+
+    @functools.wraps(fn)
+    def call(*args):
+        if not compiled:
+            try:
+                import numba
+                compiled.append(numba.njit(cache=True, nogil=True)(fn))
+            except ImportError:
+                compiled.append(fn)
+        return compiled[0](*args)
+    call.py_func = fn
+    return call
+
+
+# t the arguments below are the arrays of an EventStore (or of the store
+# t from its day_groups(), with counts the events on each day): offsets
+# t into days, bin by bin, and mu with one value per bin.
+@jit
+def emstep(offsets, days, counts, mu, theta, omega, T):
+    ''' predpol.emstep_recursive: the decay sums, the E-step and the M-step
+        sums in one pass over the days of each bin. returns omega, theta
+        and mu.
+    '''
+    kernel = theta * omega
+    sum_pijs = 0.0
+    lagged = 0.0
+    total = 0
+    new_mu = np.empty(len(mu))
+    for b in range(len(offsets) - 1):
+        A = 0.0
+        B = 0.0
+        background = 0.0
+        for i in range(offsets[b], offsets[b + 1]):
+            if i > offsets[b]:
+                gap = days[i] - days[i - 1]
+                decay = math.exp(-omega * gap)
+                earlier = A + counts[i - 1]
+                A = decay * earlier
+                B = decay * (B + gap * earlier)
+            # t every event on a day shares that day's denominator
+            denom = mu[b] + kernel * A
+            weight = counts[i] * kernel / denom
+            sum_pijs += weight * A
+            lagged += weight * B
+            background += counts[i] * mu[b] / denom
+            total += counts[i]
+        new_mu[b] = background / T
+    return sum_pijs / lagged, sum_pijs / total, new_mu
+
+
+@jit
+def loglik(offsets, days, counts, mu, theta, omega, T):
+    ''' the objective of predpol.make_engine '''
+    kernel = theta * omega
+    out = 0.0
+    total = 0
+    for b in range(len(offsets) - 1):
+        A = 0.0
+        for i in range(offsets[b], offsets[b + 1]):
+            if i > offsets[b]:
+                A = math.exp(-omega * (days[i] - days[i - 1])) * (
+                    A + counts[i - 1])
+            out += counts[i] * math.log(mu[b] + kernel * A)
+            total += counts[i]
+        out -= T * mu[b]
+    return out - theta * total
+
+
+@jit
+def rates(offsets, days, mu, theta, omega, pred_day):
+    ''' predpol.calc_rates at a single day '''
+    out = np.empty(len(mu))
+    for b in range(len(offsets) - 1):
+        epart = 0.0
+        for i in range(offsets[b], offsets[b + 1]):
+            lag = pred_day - days[i]
+            if lag > 0:
+                epart += math.exp(-omega * lag)
+        out[b] = mu[b] + theta * omega * epart
+    return out
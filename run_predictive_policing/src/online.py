@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# daily forecasts without refitting the whole window every morning: an
+# online EM that takes in one day of events at a time.
+#
+
+import collections
+import numpy as np
+import predpol as pp
+import eventstore as es
+
+
+class OnlineEM(object):
+    ''' the model of predpol.runEM, fit to the last `window` days by online
+        EM. ingest() takes the events of one day: their E-step uses the
+        current parameters and each bin's running decay sums (the A and B
+        of pp.calc_decay_sums, carried forward from the bin's last event),
+        so it costs time in the new events only. the day's sufficient
+        statistics join those of the window, the ones of the day falling
+        out of the window are dropped, and the M-step reads the
+        parameters off the window's totals.
+
+        the statistics of earlier days keep the parameters they were
+        computed with, and the decay sums keep events from before the
+        window; anchor() refits the window with runEM and recomputes both,
+        after which ingest() carries on from the batch fit.
+
+        omega, theta -- the current triggering kernel
+        mu           -- background rate by bin label; bins with no events
+                        in the window have 0
+    '''
+
+    def __init__(self, window, omega=1.0, theta=1.0, mu_init=1.0):
+        self.window = window
+        self.omega = omega
+        self.theta = theta
+        self.mu_init = mu_init
+        self.mu = np.zeros(0)
+        # (day, bins) of each day in the window with events, for anchor()
+        # to refit from; days drop out with their statistics
+        self.events = collections.deque()
+        self._reset()
+
+    def _reset(self):
+        self.last_day = None
+        # per bin label: day of its last event and the decay sums there,
+        # counting the events of that day
+        self._last = np.zeros(len(self.mu), dtype=np.int64)
+        self._A = np.zeros(len(self.mu))
+        self._B = np.zeros(len(self.mu))
+        # per bin label: events and background weight in the window
+        self._count = np.zeros(len(self.mu), dtype=np.int64)
+        self._background = np.zeros(len(self.mu))
+        # window totals, and each day's share of them to expire later
+        self._triggered = 0.0
+        self._lagged = 0.0
+        self._days = collections.deque()
+
+    def _grow(self, max_bin):
+        ''' make room for bin labels up to max_bin '''
+        size = len(self.mu)
+        if max_bin < size:
+            return
+        size = max(2 * size, max_bin + 1)
+        for name in ['mu', '_last', '_A', '_B', '_count', '_background']:
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _estep(self, day, bins):
+        ''' the E-step for the events (bins) on day, at the current
+            parameters; moves the decay sums of their bins up to day and
+            adds the day's statistics to the window's totals.
+        '''
+        labels, counts = np.unique(bins, return_counts=True)
+        self._grow(labels[-1])
+        # t bins new to the window start from mu_init, as in runEM
+        mu = np.where(self.mu[labels] > 0, self.mu[labels], self.mu_init)
+        gap = day - self._last[labels]
+        decay = np.exp(-self.omega * gap)
+        A = decay * self._A[labels]
+        B = decay * (self._B[labels] + gap * self._A[labels])
+        # t as in emstep_recursive: the events of a day share a denominator
+        kernel = self.theta * self.omega
+        denom = mu + kernel * A
+        triggered = np.sum(counts * kernel * A / denom)
+        lagged = np.sum(counts * kernel * B / denom)
+        background = counts * mu / denom
+
+        self._A[labels] = A + counts
+        self._B[labels] = B
+        self._last[labels] = day
+        self._count[labels] += counts
+        self._background[labels] += background
+        self._triggered += triggered
+        self._lagged += lagged
+        self._days.append((day, labels, counts, background, triggered,
+                           lagged))
+        self.last_day = day
+
+    def _expire(self):
+        ''' drop the statistics and events of days before the window '''
+        while self.events and self.events[0][0] <= self.last_day - self.window:
+            self.events.popleft()
+        while self._days and self._days[0][0] <= self.last_day - self.window:
+            _, labels, counts, background, triggered, lagged = \
+                self._days.popleft()
+            self._count[labels] -= counts
+            self._background[labels] -= background
+            self._triggered -= triggered
+            self._lagged -= lagged
+        # t subtracting can leave float dust where the window is empty
+        self._background[self._count == 0] = 0.0
+
+    def _mstep(self):
+        total = np.sum(self._count)
+        # t with no pairs in the window yet the kernel can't be estimated
+        if self._triggered > 0 and self._lagged > 0:
+            self.omega = self._triggered / self._lagged
+            self.theta = self._triggered / total
+        self.mu = self._background / self.window
+
+    def ingest(self, day, bins):
+        ''' take in the events on day number `day`, one bin label per
+            event, and update the fit. days must come in increasing order.
+        '''
+        bins = np.asarray(bins, dtype=np.int64)
+        assert self.last_day is None or day > self.last_day
+        if len(bins) > 0:
+            self.events.append((day, bins))
+            self._estep(day, bins)
+        self.last_day = day
+        self._expire()
+        self._mstep()
+
+    def rates(self, day=None):
+        ''' the bin labels with events in the window and their rates on day
+            number `day`, by default the day after the last one ingested
+        '''
+        if day is None:
+            day = self.last_day + 1
+        labels = np.flatnonzero(self._count)
+        decay = np.exp(-self.omega * (day - self._last[labels]))
+        return labels, (self.mu[labels] +
+                        self.theta * self.omega * decay * self._A[labels])
+
+    def top_k(self, k=20, day=None):
+        ''' the k bins with the highest rates on day, highest first '''
+        labels, rates = self.rates(day)
+        return pp.top_k(rates, labels, k)
+
+    def window_store(self):
+        ''' the EventStore of the events in the window '''
+        if not self.events:
+            empty = np.zeros(0, dtype=np.int64)
+            return es.EventStore.from_arrays(empty, empty)
+        return es.EventStore.from_arrays(
+            np.concatenate([bins for _, bins in self.events]),
+            np.concatenate([np.repeat(day, len(bins))
+                            for day, bins in self.events]))
+
+    def anchor(self, **kwargs):
+        ''' refit the window with pp.runEM, starting from the current fit,
+            and restart the online statistics from the batch fit. kwargs
+            go to runEM. returns runEM's fit.
+        '''
+        store = self.window_store()
+        init = dict(omega=self.omega, theta=self.theta,
+                    mu=dict((n, self.mu[n]) for n in store.keys
+                            if n < len(self.mu) and self.mu[n] > 0))
+        pred_date = np.datetime64(int(self.last_day) + 1, 'D')
+        fit = pp.runEM(store, self.window, pred_date, init=init,
+                       mu_init=self.mu_init, full_output=True, **kwargs)[4]
+
+        # t replay the window at the batch fit; its E-step is the batch's
+        last_day = self.last_day
+        self._reset()
+        self.omega = fit['omega']
+        self.theta = fit['theta']
+        self.mu[:] = 0.0
+        for n, mu in fit['mu'].items():
+            self.mu[n] = mu
+        groups, counts = store.day_groups()
+        labels = np.repeat(groups.keys, groups.counts)
+        for day in np.unique(groups.days):
+            on = groups.days == day
+            self._estep(int(day), np.repeat(labels[on], counts[on]))
+        self.last_day = last_day
+        return fit
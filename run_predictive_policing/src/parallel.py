@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# the days of a simulation without added crimes, spread over processes.
+# with nothing added, each day's fit depends only on the events in its
+# window, so the days can be split into blocks and the blocks run at
+# once. the workers read one shared-memory copy of the events and write
+# their rates and diagnostics straight into shared result arrays.
+#
+
+import multiprocessing as mp
+import numpy as np
+import eventstore as es
+import sharedarrays as sa
+from simulation import Simulation
+
+# t the per-day results the workers fill in, one column or entry per day
+OUTPUTS = ['rates', 'iterations', 'seconds', 'converged']
+
+
+def _work(state, spec, first, last, slot):
+    ''' run days first to last - 1 of the simulation in state '''
+    # t the blocks stay open until the process exits, with the views
+    blocks, arrays = sa.attach(spec)
+    sim = Simulation.__new__(Simulation)
+    sim.__dict__.update(state)
+    sim.index = es.EventIndex.from_store(es.EventStore(
+        arrays['keys'], arrays['days'], arrays['offsets']))
+    for name in OUTPUTS:
+        setattr(sim, name, arrays[name])
+    sim.targeted = arrays['targeted'][slot]
+    sim.seek(first).run(until=last)
+
+
+def run(sim, workers):
+    ''' run a Simulation without added crimes from its current day to the
+        end, in `workers` processes, each a block of consecutive days.
+        returns sim, at the end, for results(); the last fit isn't
+        brought back from the workers. the results are the ones sim.run()
+        would give.
+
+        sim has to start every day's fit cold: a warm start, like added
+        crimes, ties each day to the fit of the day before.
+    '''
+    assert not sim.add_crimes_logical, \
+        'with added crimes every day depends on the fit of the day before'
+    assert not sim.warm_start, \
+        'with warm starts every day starts from the fit of the day before'
+    days = np.arange(sim.i, sim.num_predictions)
+    blocks = [b for b in np.array_split(days, workers) if len(b) > 0]
+    store = sim.index.store
+    arrays = dict(keys=store.keys, days=store.days, offsets=store.offsets,
+                  targeted=np.zeros((len(blocks), sim.max_bin + 1),
+                                    dtype=np.int64))
+    for name in OUTPUTS:
+        arrays[name] = getattr(sim, name)
+    # t everything else is small; the module np.random can't be pickled,
+    # t but without added crimes there's nothing to draw
+    state = dict(sim.__dict__, index=None, daily_counts=None, log=None,
+                 rng=None, **dict((name, None) for name in OUTPUTS))
+
+    shared, views, spec = sa.share(arrays)
+    try:
+        procs = [mp.Process(target=_work,
+                            args=(state, spec, b[0], b[-1] + 1, slot))
+                 for slot, b in enumerate(blocks)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        failed = sum(p.exitcode != 0 for p in procs)
+        if failed:
+            raise RuntimeError('{} of {} workers failed'.format(
+                failed, len(procs)))
+        for name in OUTPUTS:
+            getattr(sim, name)[...] = views[name]
+        sim.targeted += views['targeted'].sum(axis=0)
+        sim.i = sim.num_predictions
+    finally:
+        sa.release(shared, views)
+    return sim
@@ -12,42 +12,81 @@
 #
 
 import numpy as np
-import copy
+import time
+import eventstore as es
+import kernels
 
-
-def lower_tri_ij(dim):
-    ''' tril_indices makes lower-triangular indexing easy '''
-    ii, jj = np.tril_indices(dim)
-    for i, j in zip(ii, jj):
-        yield i, j
+# the banded engines drop the pairs whose kernel exp(-omega * lag) is below
+# this, relative to a same-day pair
+BAND_TOL = 1e-8
 
 
 def lambdafun(t, mu, theta, omega):
-    days_til_last = [(t[-1] - ti).days for ti in t[:-1]]
-    epart = sum([np.exp(-omega * d) for d in days_til_last])
+    days = es.to_days(t)
+    days_til_last = days[-1] - days[:-1]
+    epart = np.sum(np.exp(-omega * days_til_last))
     return mu + theta * omega * epart
 
 
+def calc_rates(store, mu, theta, omega, pred_days):
+    ''' lambdafun for every bin of an EventStore at once: the conditional
+        intensity at day number pred_days, counting the events before it.
+        pred_days can also be an array of days, which gives one column of
+        rates per day.
+    '''
+    pred_days = np.asarray(pred_days, dtype=np.int64)
+    if len(store) == 0:
+        return np.zeros(pred_days.shape + (0,)).T
+    if kernels.ENABLED and pred_days.ndim == 0:
+        return kernels.rates(store.offsets, store.days,
+                             np.asarray(mu, dtype=np.float64), theta, omega,
+                             int(pred_days))
+    lags = pred_days[..., np.newaxis] - store.days
+    epart = np.where(lags > 0, np.exp(-omega * np.maximum(lags, 0)), 0.0)
+    sums = np.add.reduceat(epart, store.starts, axis=-1)
+    return (mu + theta * omega * sums).T
+
+
+def top_k(rates, keys, k):
+    ''' the k keys with the highest rates, highest first, with ties going
+        to the larger key as in sorted(zip(rates, keys), reverse=True).
+        argpartition finds the k-th rate without sorting all of them.
+    '''
+    rates = np.asarray(rates)
+    keys = np.asarray(keys)
+    k = min(k, len(rates))
+    if k == 0:
+        return []
+    kth = np.argpartition(-rates, k - 1)[k - 1]
+    # everything tied with the k-th rate competes on its key
+    candidates = np.flatnonzero(rates >= rates[kth])
+    order = np.lexsort((keys[candidates], rates[candidates]))[::-1]
+    return keys[candidates[order[:k]]].tolist()
+
+
 def calc_tij(data):
+    ''' lag in days from each event j to each later event i + 1, for j <= i;
+        the upper triangle is zero. built by broadcasting the day numbers
+        instead of visiting the (n-1)x(n-1) cells one at a time.
+    '''
     assert all([len(n) > 0 for n in data.values()])
     tij = dict()
     for n, events in data.items():
-        tij_len = len(events) - 1
-        tij[n] = np.zeros((tij_len, tij_len))
-        for i, j in lower_tri_ij(tij_len):
-            td = (events[i + 1] - events[j]).days
-            tij[n][i, j] = td
+        days = es.to_days(events)
+        lags = days[1:, np.newaxis] - days[np.newaxis, :-1]
+        tij[n] = np.tril(lags).astype(np.float64)
     return tij
 
 
 def calc_pij(tij, theta, omega):
+    ''' triggering kernel theta * omega * exp(-omega * tij) for every
+        positive lag; same-day pairs and the upper triangle stay zero.
+    '''
     pij = dict()
     for n in tij:
-        pij[n] = np.zeros(tij[n].shape)
-        for i, j in lower_tri_ij(tij[n].shape[0]):
-            if tij[n][i, j] > 0:
-                e_part = np.exp(-omega * tij[n][i, j])
-                pij[n][i, j] = e_part * theta * omega
+        lags = tij[n]
+        mask = lags > 0
+        pij[n] = np.where(mask, theta * omega * np.exp(-omega * lags), 0.0)
     return pij
 
 
@@ -61,7 +100,12 @@ def estep(data, mu, theta, omega, tij):
         # should possibly append a 1 to the front of this
         denom = mu[n] + pij[n].sum(axis=1)
         pj[n] = mu[n] / denom
-        pij[n] = pij[n] / denom
+        # each row i is normalized by its own denominator: row i holds the
+        # probabilities that event i was triggered by each earlier event,
+        # which with pj[i] add up to 1. dividing by denom alone broadcast
+        # over the columns, scaling entry (i, j) by row j's denominator;
+        # with evenly spaced events the two nearly agree, otherwise not.
+        pij[n] = pij[n] / denom[:, np.newaxis]
         pj[n] = np.append(pj[n], 1)
     return pij, pj
 
@@ -84,27 +128,244 @@ def mstep(pij, pj, tij, data, T):
     return omega, theta, mu
 
 
-def runEM(data, T, pred_date, k=20,
-          theta_init=1, omega_init=1, mu_init=1,
-          tol1=.00001, tol2=.00001, tol3=.0001):
-    num_bins = len(data)
-    theta = theta_init
-    mu = dict((key, mu_init) for key in data)
-    omega = omega_init
+def estep_packed(store, mu, theta, omega, rows, lags):
+    ''' estep for every bin in an EventStore at once.
+        mu is a vector over store.keys; (rows, lags) come from store.pairs().
+        returns the normalized pij of every pair and pj of every event; the
+        first event in a bin has no earlier events, so its pj is 1.
+    '''
+    mu_events = mu[store.segment_ids()]
+    pij = theta * omega * np.exp(-omega * lags)
+    denom = mu_events + np.bincount(rows, weights=pij,
+                                    minlength=store.num_events)
+    pj = mu_events / denom
+    pij = pij / denom[rows]
+    return pij, pj
+
+
+def mstep_packed(store, pij, pj, lags, T):
+    ''' mstep for every bin in an EventStore at once; mu comes back as a
+        vector over store.keys.
+    '''
+    sum_pijs = np.sum(pij)
+    omega = sum_pijs / np.dot(pij, lags)
+    theta = sum_pijs / store.num_events
+    mu = np.add.reduceat(pj, store.starts) / T
+    return omega, theta, mu
+
+
+def calc_decay_sums(groups, counts, omega):
+    ''' the kernel sums each distinct day d of a bin needs from the bin's
+        earlier days d' (groups and counts come from store.day_groups()):
+            A[d] = sum counts[d'] * exp(-omega * (d - d'))
+            B[d] = sum counts[d'] * exp(-omega * (d - d')) * (d - d')
+        with gap = d - (previous day) both follow from the previous day:
+            A[d] = exp(-omega * gap) * (A[prev] + counts[prev])
+            B[d] = exp(-omega * gap) *
+                   (B[prev] + gap * (A[prev] + counts[prev]))
+        so a single pass over the days in each bin is enough; all bins take
+        the pass together, one vectorized step per day rank. omega can also
+        be an array with a value for every day in groups.
+    '''
+    A = np.zeros(groups.num_events)
+    B = np.zeros(groups.num_events)
+    omega = np.broadcast_to(omega, (groups.num_events,))
+    for idx in groups.rank_schedule():
+        prev = idx - 1
+        gap = groups.days[idx] - groups.days[prev]
+        decay = np.exp(-omega[idx] * gap)
+        earlier = A[prev] + counts[prev]
+        A[idx] = decay * earlier
+        B[idx] = decay * (B[prev] + gap * earlier)
+    return A, B
+
+
+def emstep_recursive(groups, counts, mu, theta, omega, T):
+    ''' one estep + mstep with the exponential kernel, from the recursive
+        sums of calc_decay_sums. the rows of pij are only ever needed
+        through their sums, so no pair of events is ever materialized:
+        time and memory are linear in the number of distinct (bin, day)s.
+    '''
+    mu_days = mu[groups.segment_ids()]
+    A, B = calc_decay_sums(groups, counts, omega)
+    denom = mu_days + theta * omega * A
+    # every event on a day shares that day's denominator
+    weight = counts * theta * omega / denom
+    sum_pijs = np.dot(weight, A)
+    omega = sum_pijs / np.dot(weight, B)
+    theta = sum_pijs / np.sum(counts)
+    mu = np.add.reduceat(counts * mu_days / denom, groups.starts) / T
+    return omega, theta, mu
+
+
+def band_horizon(omega, tol=BAND_TOL):
+    ''' the longest lag, in days, whose kernel exp(-omega * lag) is still
+        at least tol
+    '''
+    return int(np.floor(np.log(1 / tol) / omega))
+
+
+def make_engine(store, T, engine='auto', band_tol=BAND_TOL):
+    ''' set up one EM engine for an EventStore; returns two functions of
+        (mu, theta, omega): emstep, giving the next (omega, theta, mu), and
+        loglik, the objective the EM climbs:
+            sum log(lambda(t_i)) - T * sum(mu) - theta * (number of events)
+        (the log-likelihood with every event's offspring counted inside
+        the window, which is what makes theta = sum(pij) / N in mstep).
+        'matrix'    -- estep_packed/mstep_packed over every pair of events
+        'recursive' -- emstep_recursive; linear in the events, exponential
+                       kernel only
+        'jit'       -- 'recursive' as compiled loops from kernels, when
+                       kernels.ENABLED; 'recursive' itself when not
+        'auto'      -- 'jit' when kernels.ENABLED, 'matrix' when not
+        'banded'    -- 'matrix' over the pairs within band_horizon(omega,
+                       band_tol) days of each other only; the band is found
+                       again when omega moves far enough to need another
+        'banded32'  -- 'banded' with the lags and kernel in float32
+    '''
+    if engine == 'auto':
+        engine = 'jit' if kernels.ENABLED else 'matrix'
+    if engine in ('banded', 'banded32'):
+        dtype = np.float32 if engine == 'banded32' else np.float64
+        band = dict(horizon=-1)
+
+        def pairs(omega):
+            ''' the pairs within the horizon omega needs, found again if
+                the band is too narrow for it or twice as wide '''
+            horizon = band_horizon(omega, band_tol)
+            if horizon > band['horizon'] or 2 * horizon < band['horizon']:
+                # t with room to spare, so small moves in omega reuse it
+                band['horizon'] = int(np.ceil(1.25 * horizon))
+                rows, lags = store.pairs(band['horizon'])
+                band['rows'], band['lags'] = rows, lags.astype(dtype)
+            return band['rows'], band['lags']
+
+        def emstep(mu, theta, omega):
+            rows, lags = pairs(omega)
+            pij, pj = estep_packed(store, mu, theta, omega, rows, lags)
+            return mstep_packed(store, pij, pj, lags, T)
+
+        def loglik(mu, theta, omega):
+            rows, lags = pairs(omega)
+            trig = np.bincount(rows,
+                               weights=theta * omega * np.exp(-omega * lags),
+                               minlength=store.num_events)
+            intensity = mu[store.segment_ids()] + trig
+            return (np.sum(np.log(intensity)) - T * np.sum(mu) -
+                    theta * store.num_events)
+    elif engine == 'matrix':
+        rows, lags = store.pairs()
+
+        def emstep(mu, theta, omega):
+            pij, pj = estep_packed(store, mu, theta, omega, rows, lags)
+            return mstep_packed(store, pij, pj, lags, T)
+
+        def loglik(mu, theta, omega):
+            trig = np.bincount(rows,
+                               weights=theta * omega * np.exp(-omega * lags),
+                               minlength=store.num_events)
+            intensity = mu[store.segment_ids()] + trig
+            return (np.sum(np.log(intensity)) - T * np.sum(mu) -
+                    theta * store.num_events)
+    elif engine == 'jit' and kernels.ENABLED:
+        groups, counts = store.day_groups()
+        offsets, days = groups.offsets, groups.days
+
+        def emstep(mu, theta, omega):
+            return kernels.emstep(offsets, days, counts, mu, theta, omega, T)
+
+        def loglik(mu, theta, omega):
+            return kernels.loglik(offsets, days, counts, mu, theta, omega, T)
+    elif engine in ('recursive', 'jit'):
+        groups, counts = store.day_groups()
+
+        def emstep(mu, theta, omega):
+            return emstep_recursive(groups, counts, mu, theta, omega, T)
+
+        def loglik(mu, theta, omega):
+            A, B = calc_decay_sums(groups, counts, omega)
+            intensity = mu[groups.segment_ids()] + theta * omega * A
+            return (np.dot(counts, np.log(intensity)) - T * np.sum(mu) -
+                    theta * store.num_events)
+    else:
+        raise ValueError('unknown EM engine: {}'.format(engine))
+    return emstep, loglik
+
+
+def squarem_step(emstep, loglik, omega, theta, mu):
+    ''' one SQUAREM cycle (Varadhan & Roland 2008, scheme S3): two EM
+        steps give the direction r and curvature v of the fixed-point
+        iteration, the extrapolated point x0 - 2 a r + a^2 v jumps along
+        them, and a last EM step from there stabilizes it. the step length
+        a is halved back toward -1 (where the jump is plain EM twice)
+        until the point is feasible and doesn't lower loglik, so the
+        cycle is monotone. returns omega, theta, mu and the EM steps used.
+    '''
+    x0 = np.concatenate([[omega, theta], mu])
+    omega1, theta1, mu1 = emstep(mu, theta, omega)
+    x1 = np.concatenate([[omega1, theta1], mu1])
+    omega2, theta2, mu2 = emstep(mu1, theta1, omega1)
+    x2 = np.concatenate([[omega2, theta2], mu2])
+    r = x1 - x0
+    v = x2 - x1 - r
+    vv = np.dot(v, v)
+    if vv == 0:
+        return omega2, theta2, mu2, 2
+    alpha = min(-np.sqrt(np.dot(r, r) / vv), -1.0)
+    floor = loglik(mu, theta, omega)
+    x = x2
+    while alpha < -1.01:
+        jump = x0 - 2 * alpha * r + alpha ** 2 * v
+        if np.all(jump > 0) and loglik(jump[2:], jump[1], jump[0]) >= floor:
+            x = jump
+            break
+        # halve the distance to -1
+        alpha = (alpha - 1) / 2
+    omega, theta, mu = emstep(x[2:], x[1], x[0])
+    return omega, theta, mu, 3
+
+
+def fitEM(store, T, omega, theta, mu,
+          tol1=.00001, tol2=.00001, tol3=.0001, engine='auto',
+          accelerate=False, max_iter=None, band_tol=BAND_TOL, strict=False):
+    ''' run EM on an EventStore from (omega, theta, mu) until the change in
+        any one of them is within its tolerance, or max_iter EM steps have
+        been taken; with strict=True, until the changes in all of them
+        are. accelerate=True takes squarem_step cycles instead of
+        single EM steps. returns omega, theta, mu and the diagnostics
+        dict(iterations, seconds, converged, loglik, setup_seconds), where
+        seconds is the time spent in EM steps and setup_seconds the time
+        spent building the engine before them. the banded engines also
+        report the horizon at the fit and loglik_error, their loglik less
+        the one over every pair.
+    '''
+    started = time.time()
+    emstep, loglik = make_engine(store, T, engine, band_tol)
+    setup_seconds = time.time() - started
+    started = time.time()
     omega_last = 10 + omega
     theta_last = 10 + theta
-    mu_last = dict((key, mu_init + 10) for key in data)
-    k = min(num_bins, k)
-    tij = calc_tij(data)
+    mu_last = mu + 10
+    iterations = 0
+    converged = False
 
-    while(abs(omega - omega_last) > tol1 and
-          abs(theta - theta_last) > tol2 and
-          sum([abs(mu[n] - mu_last[n]) for n in mu]) > tol3):
+    while True:
+        changes = [abs(omega - omega_last) > tol1,
+                   abs(theta - theta_last) > tol2,
+                   np.sum(np.abs(mu - mu_last)) > tol3]
+        converged = not (any(changes) if strict else all(changes))
+        if converged or (max_iter is not None and iterations >= max_iter):
+            break
         omega_last = omega
         theta_last = theta
-        mu_last = copy.deepcopy(mu)
-        pij, pj = estep(data, mu, theta, omega, tij)
-        omega, theta, mu = mstep(pij, pj, tij, data, T)
+        mu_last = mu
+        if accelerate and (max_iter is None or iterations + 3 <= max_iter):
+            omega, theta, mu, steps = squarem_step(emstep, loglik,
+                                                   omega, theta, mu)
+        else:
+            omega, theta, mu = emstep(mu, theta, omega)
+            steps = 1
+        iterations += steps
 
         # deprecate?
         # I did this when I was debugging so that it wouldn't run away
@@ -112,16 +373,230 @@ def runEM(data, T, pred_date, k=20,
         #    omega = omega_last
         assert omega < T * 1000
 
-    # get conditional intensity for selected parameters
-    # need to add on latest date
-    for n in data:
-        data[n] = np.append(data[n], pred_date)
+    info = dict(iterations=iterations, seconds=time.time() - started,
+                converged=converged, loglik=loglik(mu, theta, omega),
+                setup_seconds=setup_seconds)
+    if engine in ('banded', 'banded32'):
+        # t the recursive engine's loglik is exact, and linear in the events
+        exact = make_engine(store, T, 'recursive')[1](mu, theta, omega)
+        info['horizon'] = band_horizon(omega, band_tol)
+        info['loglik_error'] = info['loglik'] - exact
+    return omega, theta, mu, info
+
+
+def make_batch_engine(stores, T, engine='matrix'):
+    ''' make_engine's emstep for several independent datasets at once: the
+        stores are concatenated and every array op covers all of them,
+        with omega and theta vectors over the datasets and mu one vector
+        over all their bins, in order. T has a value per dataset. returns
+        emstep(mu, theta, omega) -> (omega, theta, mu) and the dataset of
+        each bin.
+    '''
+    store = es.EventStore.concatenate(stores)
+    num_sets = len(stores)
+    bin_set = np.repeat(np.arange(num_sets), [len(s) for s in stores])
+    num_events = np.bincount(bin_set, weights=store.counts,
+                             minlength=num_sets)
+    T_bins = np.asarray(T, dtype=np.float64)[bin_set]
+    if engine == 'matrix':
+        rows, lags = store.pairs()
+        seg = store.segment_ids()
+        pair_set = bin_set[seg[rows]]
+
+        def emstep(mu, theta, omega):
+            # t estep_packed and mstep_packed, with per-dataset parameters
+            pair_omega = omega[pair_set]
+            pij = theta[pair_set] * pair_omega * np.exp(-pair_omega * lags)
+            mu_events = mu[seg]
+            denom = mu_events + np.bincount(rows, weights=pij,
+                                            minlength=store.num_events)
+            pj = mu_events / denom
+            pij = pij / denom[rows]
+            sum_pijs = np.bincount(pair_set, weights=pij,
+                                   minlength=num_sets)
+            omega = sum_pijs / np.bincount(pair_set, weights=pij * lags,
+                                           minlength=num_sets)
+            theta = sum_pijs / num_events
+            mu = np.add.reduceat(pj, store.starts) / T_bins
+            return omega, theta, mu
+    elif engine == 'recursive':
+        groups, counts = store.day_groups()
+        day_bin = groups.segment_ids()
+        day_set = bin_set[day_bin]
 
+        def emstep(mu, theta, omega):
+            # t emstep_recursive, with per-dataset parameters
+            mu_days = mu[day_bin]
+            A, B = calc_decay_sums(groups, counts, omega[day_set])
+            kernel = theta[day_set] * omega[day_set]
+            denom = mu_days + kernel * A
+            weight = counts * kernel / denom
+            sum_pijs = np.bincount(day_set, weights=weight * A,
+                                   minlength=num_sets)
+            omega = sum_pijs / np.bincount(day_set, weights=weight * B,
+                                           minlength=num_sets)
+            theta = sum_pijs / num_events
+            mu = np.add.reduceat(counts * mu_days / denom,
+                                 groups.starts) / T_bins
+            return omega, theta, mu
+    else:
+        raise ValueError('unknown EM engine: {}'.format(engine))
+    return emstep, bin_set
+
+
+def fitEM_batch(stores, T, omega=1.0, theta=1.0, mu=None,
+                tol1=.00001, tol2=.00001, tol3=.0001, engine='matrix',
+                max_iter=None, strict=False):
+    ''' fitEM for a list of independent EventStores (cities, crime types)
+        in one loop: each dataset has its own omega, theta and mu and its
+        own convergence test, and the E/M steps of all the datasets still
+        running are taken together by make_batch_engine. a dataset that
+        converges (or reaches max_iter) drops out, and the rest are packed
+        again without it. T, omega and theta are scalars or have one value
+        per dataset; mu is None (all ones) or a list of vectors over each
+        store's keys. returns the lists omega, theta, mu and info, with
+        fitEM's diagnostics dict(iterations, seconds, converged) for each
+        dataset, seconds counting until it dropped out. strict is
+        fitEM's.
+    '''
+    num_sets = len(stores)
+    T = np.broadcast_to(np.asarray(T, dtype=np.float64), (num_sets,))
+    omega = np.array(np.broadcast_to(omega, (num_sets,)), dtype=np.float64)
+    theta = np.array(np.broadcast_to(theta, (num_sets,)), dtype=np.float64)
+    if mu is None:
+        mu = [np.ones(len(s)) for s in stores]
+    mu = [np.asarray(m, dtype=np.float64) for m in mu]
+    iterations = np.zeros(num_sets, dtype=np.int64)
+    converged = np.zeros(num_sets, dtype=bool)
+    seconds = np.zeros(num_sets)
+    done = np.zeros(num_sets, dtype=bool)
+    if max_iter is not None and max_iter <= 0:
+        done[:] = True
+    started = time.time()
+
+    while not np.all(done):
+        # t (re)pack the datasets still running
+        active = np.flatnonzero(~done)
+        emstep, bin_set = make_batch_engine([stores[d] for d in active],
+                                            T[active], engine)
+        splits = np.cumsum([len(stores[d]) for d in active])[:-1]
+        mu_active = np.concatenate([mu[d] for d in active])
+        omega_active = omega[active]
+        theta_active = theta[active]
+        running = np.ones(len(active), dtype=bool)
+        # t stopped datasets stay in the pack, frozen, until half have
+        # t stopped: repacking after every one would cost more than it saves
+        while np.sum(running) * 2 > len(active):
+            omega_last = omega_active
+            theta_last = theta_active
+            mu_last = mu_active
+            omega_active, theta_active, mu_active = emstep(
+                mu_active, theta_active, omega_active)
+            omega_active = np.where(running, omega_active, omega_last)
+            theta_active = np.where(running, theta_active, theta_last)
+            mu_active = np.where(running[bin_set], mu_active, mu_last)
+            iterations[active[running]] += 1
+            assert np.all(omega_active < T[active] * 1000)
+            mu_change = np.bincount(bin_set,
+                                    weights=np.abs(mu_active - mu_last),
+                                    minlength=len(active))
+            # t as in fitEM: any one parameter within tolerance will do,
+            # t or with strict all of them
+            changes = np.array([np.abs(omega_active - omega_last) > tol1,
+                                np.abs(theta_active - theta_last) > tol2,
+                                mu_change > tol3])
+            stop = ~(changes.any(axis=0) if strict else changes.all(axis=0))
+            converged[active[running]] = stop[running]
+            if max_iter is not None:
+                stop |= iterations[active] >= max_iter
+            stopping = running & stop
+            seconds[active[stopping]] = time.time() - started
+            done[active[stopping]] = True
+            running &= ~stop
+        omega[active] = omega_active
+        theta[active] = theta_active
+        for d, m in zip(active, np.split(mu_active, splits)):
+            mu[d] = m
+
+    info = [dict(iterations=int(iterations[d]), seconds=seconds[d],
+                 converged=bool(converged[d])) for d in range(num_sets)]
+    return list(omega), list(theta), mu, info
+
+
+def runEM(data, T, pred_date, k=20,
+          theta_init=1, omega_init=1, mu_init=1,
+          tol1=.00001, tol2=.00001, tol3=.0001, engine='auto',
+          init=None, full_output=False,
+          accelerate=False, max_iter=None, band_tol=BAND_TOL):
+    ''' fit the model to data and rank the bins by their rate at pred_date.
+        data is a dict[bin] -> list of dates, or an EventStore. init is a
+        previous fit to start from instead of the *_init values, in the
+        form returned as `fit` with full_output=True; bins it has no mu for
+        start at mu_init. a fit from init stops only once omega, theta and
+        mu have all settled (fitEM's strict): one step from a fit of a
+        window next to this one can already move one of them less than
+        its tolerance. with full_output=True the return value
+        gains that fit: dict(omega, theta, mu=dict[bin]) along with the
+        diagnostics from fitEM and predict_seconds, the time taken
+        ranking the bins. accelerate, max_iter and band_tol go to fitEM.
+    '''
+    # t the EM runs on the packed store; data stays the caller's dict
+    if isinstance(data, es.EventStore):
+        store = data
+    else:
+        store = es.EventStore.from_dict(data)
+    keys = store.keys.tolist()
+    num_bins = len(store)
+    if init is None:
+        theta = theta_init
+        mu = np.full(num_bins, mu_init, dtype=np.float64)
+        omega = omega_init
+    else:
+        theta = init['theta']
+        mu = np.array([init['mu'].get(n, mu_init) for n in keys],
+                      dtype=np.float64)
+        omega = init['omega']
+    k = min(num_bins, k)
+    omega, theta, mu, info = fitEM(store, T, omega, theta, mu,
+                                   tol1, tol2, tol3, engine,
+                                   accelerate, max_iter, band_tol,
+                                   strict=init is not None)
+
+    # get conditional intensity for selected parameters
     # todo(KL): everything else is a dict[n], shouldn't rates be a dict?
-    rates = [lambdafun(data[n], mu[n], theta, omega) for n in data]
-    sorted_keys = [key for (rate, key)
-                   in sorted(zip(rates, data), reverse=True)]
-    return rates, sorted_keys[0:k], omega, theta
+    started = time.time()
+    rates = calc_rates(store, mu, theta, omega, es.to_days([pred_date])[0])
+    tops = top_k(rates, store.keys, k)
+    rates = rates.tolist()
+    if full_output:
+        fit = dict(omega=omega, theta=theta, mu=dict(zip(keys, mu)),
+                   predict_seconds=time.time() - started, **info)
+        return rates, tops, omega, theta, fit
+    return rates, tops, omega, theta
+
+
+def runEM_batch(datasets, T, pred_dates, k=20, engine='matrix',
+                max_iter=None):
+    ''' runEM for several independent datasets (each a dict[bin] -> list
+        of dates, or an EventStore) fit together by fitEM_batch, from the
+        default starting point. T and pred_dates have one value per
+        dataset, or one for all. returns runEM's (rates, tops, omega,
+        theta) for each dataset.
+    '''
+    stores = [d if isinstance(d, es.EventStore) else
+              es.EventStore.from_dict(d) for d in datasets]
+    pred_days = np.broadcast_to(es.to_days(np.atleast_1d(pred_dates)),
+                                (len(stores),))
+    omegas, thetas, mus, _ = fitEM_batch(stores, T, engine=engine,
+                                         max_iter=max_iter)
+    out = []
+    for store, omega, theta, mu, day in zip(stores, omegas, thetas, mus,
+                                            pred_days):
+        rates = calc_rates(store, mu, theta, omega, day)
+        out.append((rates.tolist(), top_k(rates, store.keys,
+                                          min(len(store), k)),
+                    omega, theta))
+    return out
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# many stochastic trajectories of the feedback simulation at once: the
+# replicates are spread over a process pool that reads the sorted events
+# and their daily counts from shared memory, and each replicate draws its
+# added crimes from its own np.random.Generator, spawned from one root
+# seed. with --batched they are stepped together in one process instead
+# (see batched.py).
+
+
+import argparse
+import sys
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import apply_predpol as ap
+import eventcache as ec
+import eventstore as es
+import sharedarrays as sa
+from batched import BatchedSimulation
+from counts import DailyCounts
+from simulation import day_number
+assert sys.version_info.major == 3
+
+
+#function to take stuff in from makefile
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drug_crimes_with_bins", required=True)
+    parser.add_argument("--global_start", required=True)
+    parser.add_argument("--global_end", required=True)
+    parser.add_argument("--predpol_window", required=True, type=int)
+    parser.add_argument("--begin_predpol", required=True, type=int)
+    parser.add_argument("--percent_increase", required=True, type=float)
+    parser.add_argument("--replicates", required=True, type=int)
+    parser.add_argument("--seed", required=True, type=int)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--cache_dir", default=None)
+    parser.add_argument("--batched", action="store_true",
+                        help="step all the replicates together in this "
+                             "process, drawing from one generator")
+    parser.add_argument("--summary", required=True,
+                        help="where to write the .npz of summary arrays")
+    return parser.parse_args()
+
+
+## ------------ shared event arrays ----------------------------##
+# t in the workers: the shared memory blocks, kept open, and read-only
+# t views of them by name
+_blocks = []
+_shared = dict()
+
+
+def attach(spec):
+    ''' pool initializer: map the shared arrays, read-only '''
+    blocks, views = sa.attach(spec, writeable=False)
+    _blocks.extend(blocks)
+    _shared.update(views)
+
+
+def shared(name):
+    return _shared[name]
+
+
+## ------------ replicates -------------------------------------##
+def run_one(task):
+    ''' one trajectory; returns its replicate number and per-bin outputs '''
+    replicate, seed, config = task
+    rng = np.random.default_rng(seed)
+    # t the events were sorted and counted once, in the parent; each
+    # t replicate adds its crimes to an index and counts of its own
+    index = es.EventIndex.from_store(es.EventStore(
+        shared('keys'), shared('days'), shared('offsets')))
+    daily_counts = DailyCounts.from_counts(
+        shared('counts'), day_number(config['global_start']))
+    results = ap.run_predpol(None, None, rng=rng, add_crimes_logical=True,
+                             verbose=False, index=index,
+                             daily_counts=daily_counts, **config)
+    return replicate, dict(targeted=results['targeted'],
+                           observed=results['observed'].values.sum(axis=1),
+                           rates=results['rates'].values)
+
+
+def run_replicates(bins, days, config, replicates, seed, processes=None):
+    ''' run `replicates` feedback trajectories of ap.run_predpol over the
+        events (bins, days) with the keyword arguments in config, across
+        a pool of processes. replicate r draws from the r-th child of
+        np.random.SeedSequence(seed), so any one of them can be rerun
+        alone. returns dict of summary arrays:
+            targeted   -- (replicates, max_bin + 1) days in the top k
+            observed   -- (replicates, max_bin) crimes over the predictions
+            mean_rates -- (max_bin, days) rates averaged over replicates
+            dates      -- the prediction dates of mean_rates' columns
+    '''
+    max_bin = int(config['max_bin'])
+    children = np.random.SeedSequence(seed).spawn(replicates)
+    tasks = [(r, children[r], config) for r in range(replicates)]
+    targeted = np.zeros((replicates, max_bin + 1), dtype=np.int64)
+    observed = np.zeros((replicates, max_bin), dtype=np.int64)
+    rate_sum = None
+
+    store = es.EventStore.from_arrays(bins, days)
+    counts = DailyCounts(bins, days, max_bin,
+                         day_number(config['global_start']),
+                         (config['global_end'] -
+                          config['global_start']).days + 1)
+    blocks, views, spec = sa.share(dict(
+        keys=store.keys, days=store.days, offsets=store.offsets,
+        counts=counts.counts))
+    try:
+        with Pool(processes, initializer=attach, initargs=(spec,)) as pool:
+            # t imap hands results back in replicate order, so the rate
+            # t sums come out the same however the pool is sized
+            for r, out in pool.imap(run_one, tasks):
+                targeted[r] = out['targeted']
+                observed[r] = out['observed']
+                if rate_sum is None:
+                    rate_sum = np.zeros_like(out['rates'])
+                rate_sum += out['rates']
+    finally:
+        sa.release(blocks, views)
+
+    num_predictions = ((config['global_end'] - config['global_start']).days
+                       - config['predpol_window'])
+    first = config['global_start'] + pd.DateOffset(config['predpol_window'])
+    dates = [str(first + pd.DateOffset(i)).split(' ')[0]
+             for i in range(num_predictions)]
+    return dict(targeted=targeted, observed=observed,
+                mean_rates=rate_sum / replicates, dates=np.array(dates))
+
+
+def run_batched(bins, days, config, replicates, seed):
+    ''' run_replicates' summary, with the replicates stepped together by
+        a BatchedSimulation drawing from np.random.default_rng(seed).
+        the trajectories aren't run_replicates' (its replicates each have
+        a generator), but they are the same simulation.
+    '''
+    sim = BatchedSimulation(bins, days, replicates=replicates,
+                            rng=np.random.default_rng(seed),
+                            **config).run()
+    return dict(targeted=sim.targeted, observed=sim.observed()[:, 1:],
+                mean_rates=sim.rate_sum[1:] / replicates,
+                dates=np.array(sim.dates))
+
+
+def main():
+    args = getargs()
+    bins, days = ec.load_events(args.drug_crimes_with_bins, args.cache_dir)
+    max_bin = int(bins.max())
+    global_start = pd.to_datetime(args.global_start)
+    global_end = pd.to_datetime(args.global_end)
+    keep = ((days >= ap.day_number(global_start)) &
+            (days <= ap.day_number(global_end)))
+
+    config = dict(max_bin=max_bin, global_start=global_start,
+                  global_end=global_end,
+                  predpol_window=args.predpol_window,
+                  begin_predpol=args.begin_predpol,
+                  percent_increase=args.percent_increase)
+    if args.batched:
+        summary = run_batched(bins[keep], days[keep], config,
+                              args.replicates, args.seed)
+    else:
+        summary = run_replicates(bins[keep], days[keep], config,
+                                 args.replicates, args.seed, args.processes)
+    np.savez(args.summary, seed=args.seed, **summary)
+
+
+if __name__ == '__main__':
+    main()
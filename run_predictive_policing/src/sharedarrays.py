@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# numpy arrays in shared memory, for the processes of the replicate runner
+# and the day-parallel runs to read (or fill in) without copies.
+#
+
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def share(arrays):
+    ''' copy dict[name] -> array into new shared memory blocks. returns the
+        blocks, to close and unlink when done, the views of them by name,
+        and the spec to attach() to them with from another process.
+    '''
+    blocks, views, spec = [], dict(), dict()
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        blocks.append(block)
+        views[name] = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+        views[name][...] = array
+        spec[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, views, spec
+
+
+def attach(spec, writeable=True):
+    ''' the blocks and views of share()'s spec, in this process; the
+        blocks have to stay open as long as the views are used
+    '''
+    blocks, views = [], dict()
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        views[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        views[name].flags.writeable = writeable
+    return blocks, views
+
+
+def release(blocks, views):
+    ''' drop the views, then close and unlink the blocks '''
+    # t the views have to go before the memory they look at
+    views.clear()
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# the daily predpol simulation as an object that can be stepped a day at a
+# time, copied, and branched.
+#
+
+import copy
+import json
+import os
+import pickle
+import resource
+import time
+import numpy as np
+import pandas as pd
+import predpol as pp
+import eventstore as es
+from counts import DailyCounts
+
+
+def day_number(date):
+    ''' days since the epoch, the unit eventstore works in '''
+    return int(es.to_days([date])[0])
+
+
+def prepare_data_for_predpol(index, start_time, end_time):
+    ''' the events in [start_time, end_time) as an EventStore; the index
+        is already sorted, so this is two searchsorted calls, not a scan
+    '''
+    return index.window(day_number(start_time), day_number(end_time))
+
+
+class Simulation(object):
+    ''' one run of predpol over the days from global_start + predpol_window
+        to global_end: each step() fits the window ending on the next day,
+        records the rates, and, from day begin_predpol on, adds crimes to
+        the top k bins when add_crimes_logical is set.
+
+        bins and days are the events (day numbers) already limited to
+        [global_start, global_end]. rng draws the added crimes: np.random
+        by default, or a np.random.Generator for reproducible runs. with
+        warm_start each day's EM starts from the fit of the day before,
+        and runs until all its parameters settle (see pp.runEM).
+
+        each day's window is cut out of the sorted event index, and the
+        EM engine finds its pairs from the packed store.
+
+        log, a file open for writing, gets one json line per day: the
+        seconds spent in each phase of the step (window, setup, em,
+        predict, inject and the bookkeeping around them), the EM
+        iterations, the events and bins in the window, and the peak
+        memory of the process so far.
+
+        with a spatial.NeighborGraph as graph, the fits are of the model
+        with triggering between neighboring bins, spatial.runEM.
+
+        index and daily_counts, an EventIndex and DailyCounts of the same
+        events built elsewhere, are used instead of building them from
+        bins and days, which are then not needed. each Simulation adds
+        crimes to its own, so they can't be another Simulation's.
+    '''
+
+    def __init__(self, bins, days, max_bin, global_start, global_end,
+                 predpol_window, begin_predpol=0, add_crimes_logical=False,
+                 percent_increase=0.0, warm_start=False, accelerate=False,
+                 max_iter=None, rng=np.random, verbose=True, log=None,
+                 graph=None, index=None, daily_counts=None):
+        self.max_bin = int(max_bin)
+        self.global_start = global_start
+        self.global_end = global_end
+        self.predpol_window = predpol_window
+        self.begin_predpol = begin_predpol
+        self.add_crimes_logical = add_crimes_logical
+        self.percent_increase = percent_increase
+        self.warm_start = warm_start
+        self.accelerate = accelerate
+        self.max_iter = max_iter
+        self.rng = rng
+        self.verbose = verbose
+        self.log = log
+        self.graph = graph
+
+        # hold the events once, grouped by bin and sorted by day
+        if index is None:
+            index = es.EventIndex(bins, days)
+        self.index = index
+        # and the number of crimes in every bin on every day, built once
+        if daily_counts is None:
+            daily_counts = DailyCounts(
+                bins, days, self.max_bin, day_number(global_start),
+                (global_end - global_start).days + 1)
+        self.daily_counts = daily_counts
+
+        self.num_predictions = ((global_end - global_start).days -
+                                predpol_window)
+        self.i = 0
+        self.fit = None
+
+        # outputs, preallocated: rows are bins 0..max_bin as in
+        # DailyCounts, columns are the days predicted
+        first = global_start + pd.DateOffset(predpol_window)
+        self.dates = [str(first + pd.DateOffset(i)).split(' ')[0]
+                      for i in range(self.num_predictions)]
+        self.rates = np.zeros((self.max_bin + 1, self.num_predictions))
+        # EM iterations per day, to see what warm starts save
+        self.iterations = np.zeros(self.num_predictions, dtype=np.int64)
+        self.seconds = np.zeros(self.num_predictions)
+        self.converged = np.zeros(self.num_predictions, dtype=bool)
+        self.targeted = np.zeros(self.max_bin + 1, dtype=np.int64)
+
+    @property
+    def done(self):
+        return self.i >= self.num_predictions
+
+    def step(self):
+        ''' simulate day i and move on to the next '''
+        i = self.i
+        seconds = dict()
+        started = time.time()
+        start_date = self.global_start + pd.DateOffset(i)
+        end_date = self.global_start + pd.DateOffset(i + self.predpol_window)
+        end_day = day_number(end_date)
+        store = prepare_data_for_predpol(self.index, start_date, end_date)
+        seconds['window'] = time.time() - started
+        init = self.fit if self.warm_start else None
+        if self.graph is None:
+            r, o, om, thet, fit = pp.runEM(
+                store, self.predpol_window, end_date, init=init,
+                full_output=True, accelerate=self.accelerate,
+                max_iter=self.max_iter)
+        else:
+            # t the graph came from spatial, so this costs no import time
+            import spatial as sp
+            r, o, om, thet, thet_n, fit = sp.runEM(
+                store, self.graph, self.predpol_window, end_date,
+                init=init, full_output=True, max_iter=self.max_iter,
+                max_bin=self.max_bin)
+        self.fit = fit
+        # t building the engine: the pairs, or the day groups
+        seconds['setup'] = fit['setup_seconds']
+        seconds['em'] = fit['seconds']
+        seconds['predict'] = fit['predict_seconds']
+        self.iterations[i] = fit['iterations']
+        self.seconds[i] = fit['seconds']
+        self.converged[i] = fit['converged']
+        self.targeted[o] += 1
+        if self.verbose:
+            print(i, fit['iterations'])
+
+        # save rates; the spatial fit also rates the neighbors of the
+        # bins with events
+        keys = fit['bins'] if 'bins' in fit else list(fit['mu'].keys())
+        self.rates[keys, i] = r
+
+        # add p% crimes if that's what we're doing
+        injecting = time.time()
+        if self.add_crimes_logical and i >= self.begin_predpol:
+            crime_today_predicted = self.daily_counts.on(o, end_day)
+            add_crimes = self.rng.binomial(crime_today_predicted + 1,
+                                           self.percent_increase)
+            self.daily_counts.add(o, end_day, add_crimes)
+            self.index.add(np.repeat(o, add_crimes),
+                           np.repeat(end_day, add_crimes.sum()))
+            if self.verbose:
+                print(len(self.index))
+        seconds['inject'] = time.time() - injecting
+        self.i += 1
+
+        if self.log is not None:
+            total = time.time() - started
+            seconds['bookkeeping'] = total - sum(seconds.values())
+            seconds['total'] = total
+            self.log.write(json.dumps(dict(
+                day=i, date=self.dates[i], seconds=seconds,
+                iterations=int(fit['iterations']),
+                converged=bool(fit['converged']),
+                events=store.num_events, bins=len(store),
+                injected=len(self.index.injected),
+                max_rss_kb=resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss)) + '\n')
+
+    def seek(self, i):
+        ''' move on to day i without fitting the days before it. every
+            day's window comes from the index alone, so, with cold starts,
+            the fits from day i on are the ones of a run from day 0. there
+            are no added crimes to skip, and so none allowed.
+        '''
+        assert not self.add_crimes_logical and self.i <= i
+        self.i = i
+        return self
+
+    def run(self, until=None, checkpoint=None, every=30):
+        ''' step through day until - 1, or to the end. with a checkpoint
+            path, save() there every `every` days and at the end.
+        '''
+        if until is None:
+            until = self.num_predictions
+        while self.i < min(until, self.num_predictions):
+            self.step()
+            if checkpoint is not None and self.i % every == 0:
+                self.save(checkpoint)
+        if checkpoint is not None:
+            self.save(checkpoint)
+        return self
+
+    def save(self, path):
+        ''' write everything needed to carry on from today to path: the
+            events, added crimes included, the results so far, the last
+            fit and the state of rng. the file is written next to path
+            and renamed over it, so path always holds a whole checkpoint.
+        '''
+        state = dict(self.__dict__, log=None)
+        if self.rng is np.random:
+            state['rng'] = None
+            state['global_rng_state'] = np.random.get_state()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, log=None, verbose=None):
+        ''' the simulation saved at path, ready to run() on from the day
+            it was saved; the steps it takes are the ones it would have
+            taken had it never stopped. a log open for reading too (mode
+            'a+') loses its lines from that day on: the run that stopped
+            may have got further than its checkpoint, and these days are
+            logged again.
+        '''
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if 'global_rng_state' in state:
+            np.random.set_state(state.pop('global_rng_state'))
+            state['rng'] = np.random
+        sim = cls.__new__(cls)
+        sim.__dict__.update(state)
+        sim.log = log
+        if log is not None and log.readable():
+            log.seek(0)
+            kept = [line for line in log if json.loads(line)['day'] < sim.i]
+            log.seek(0)
+            log.truncate()
+            log.writelines(kept)
+        if verbose is not None:
+            sim.verbose = verbose
+        return sim
+
+    def branch(self, **changes):
+        ''' an independent copy of this simulation as of today, with
+            the given attributes (percent_increase, rng, ...) changed
+        '''
+        # t np.random, the module, can't be copied; it is shared instead.
+        # t a Generator is copied, and its copy repeats its draws. the
+        # t log file isn't copied either: a branch logs only if given one
+        other = copy.deepcopy(self, memo={id(np.random): np.random,
+                                          id(self.log): None})
+        for name, value in changes.items():
+            assert hasattr(other, name), name
+            setattr(other, name, value)
+        return other
+
+    def results(self):
+        ''' dict(rates, observed, em_iterations) as DataFrames over the
+            days simulated so far, and targeted: the number of days each
+            bin 0..max_bin was in the top k. the frames are only built
+            here, from the preallocated arrays.
+        '''
+        days = self.i
+        columns = pd.Index(self.dates[:days])
+        bins = pd.Index(range(1, self.max_bin + 1), name='bin')
+        rates = pd.DataFrame(self.rates[1:, :days], index=bins,
+                             columns=columns)
+        # the total number of crimes per day, added crimes included
+        first_end = day_number(self.global_start) + self.predpol_window
+        observed = pd.DataFrame(
+            self.daily_counts.between(first_end, first_end + days)[1:].copy(),
+            index=bins, columns=columns)
+        em_iterations = pd.DataFrame(
+            dict(iterations=self.iterations[:days],
+                 seconds=self.seconds[:days],
+                 converged=self.converged[:days]),
+            index=pd.Index(columns, name='date'))
+        return dict(rates=rates, observed=observed,
+                    em_iterations=em_iterations, targeted=self.targeted)
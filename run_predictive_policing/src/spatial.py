@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+#
+# the model with spatial triggering: an event can set off events in its
+# own bin and in the bins next to it, as in Mohler et al., with "next to"
+# a sparse neighbor graph over the bins instead of a kernel over every
+# pair of locations.
+#
+# the intensity of bin b on day t is
+#     mu[b] + theta * omega * sum_{own events j} exp(-omega * (t - t_j))
+#           + theta_n * omega * sum_{events j in neighbors of b} (same)
+# so each event has theta offspring in its bin and theta_n in each of its
+# neighbors. with theta_n = 0 it is predpol's model.
+#
+# the bin centroids can be exported from the grid the figures use with
+#     g <- readRDS("oakland_grid_data.rds")
+#     write.csv(data.frame(bin=as.integer(names(g)), coordinates(g)),
+#               "oakland_grid_centroids.csv", row.names=FALSE)
+#
+
+import time
+import numpy as np
+import pandas as pd
+import predpol as pp
+import eventstore as es
+
+
+class NeighborGraph(object):
+    ''' which bins neighbor which, in CSR form over bin labels
+        0..num_bins - 1: the neighbors of b are
+        indices[indptr[b]:indptr[b + 1]]. b is not its own neighbor.
+    '''
+
+    def __init__(self, indptr, indices):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        assert self.indptr[-1] == len(self.indices)
+
+    @classmethod
+    def from_edges(cls, a, b, num_bins=None):
+        ''' the graph with an edge between a[i] and b[i] for every i, in
+            both directions; repeated edges and self loops are dropped.
+        '''
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        if num_bins is None:
+            num_bins = int(max(a.max(), b.max())) + 1 if len(a) else 0
+        src = np.concatenate([a, b])
+        dst = np.concatenate([b, a])
+        keep = src != dst
+        pairs = np.unique(src[keep] * num_bins + dst[keep])
+        src, dst = pairs // num_bins, pairs % num_bins
+        indptr = np.zeros(num_bins + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(src, minlength=num_bins))
+        return cls(indptr, dst)
+
+    @classmethod
+    def from_points(cls, bins, x, y, radius):
+        ''' bins whose points (centroids) are within radius of each other.
+            points are bucketed into radius-sized cells, so only the
+            points in the 3x3 cells around each one are compared.
+        '''
+        bins = np.asarray(bins, dtype=np.int64)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cx = np.floor((x - x.min()) / radius).astype(np.int64)
+        cy = np.floor((y - y.min()) / radius).astype(np.int64)
+        width = cy.max() + 3
+        cell = (cx + 1) * width + (cy + 1)
+        order = np.argsort(cell, kind='stable')
+        sorted_cells = cell[order]
+        a, b = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                # t every point against the points of one adjacent cell
+                target = cell + dx * width + dy
+                lo = np.searchsorted(sorted_cells, target, 'left')
+                hi = np.searchsorted(sorted_cells, target, 'right')
+                counts = hi - lo
+                i = np.repeat(np.arange(len(bins)), counts)
+                j = order[np.arange(counts.sum()) -
+                          np.repeat(np.cumsum(counts) - counts - lo, counts)]
+                near = (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 <= radius ** 2
+                a.append(bins[i[near]])
+                b.append(bins[j[near]])
+        return cls.from_edges(np.concatenate(a), np.concatenate(b),
+                              int(bins.max()) + 1)
+
+    @classmethod
+    def from_grid(cls, rows, cols, diagonal=True):
+        ''' a rows x cols raster with bins numbered 0, 1, ... row by row;
+            the 8 surrounding cells are neighbors, or the 4 sharing an
+            edge with diagonal=False.
+        '''
+        r, c = np.divmod(np.arange(rows * cols), cols)
+        return cls.from_points(r * cols + c, c, r,
+                               np.sqrt(2) if diagonal else 1.0)
+
+    @classmethod
+    def from_csv(cls, path, radius):
+        ''' from_points over a csv with columns bin, x, y '''
+        points = pd.read_csv(path)
+        return cls.from_points(points['bin'].values, points['x'].values,
+                               points['y'].values, radius)
+
+    @property
+    def num_bins(self):
+        return len(self.indptr) - 1
+
+    def degree(self, labels):
+        ''' the number of neighbors of each bin label; 0 past the graph '''
+        labels = np.asarray(labels, dtype=np.int64)
+        inside = labels < self.num_bins
+        out = np.zeros(len(labels), dtype=np.int64)
+        out[inside] = np.diff(self.indptr)[labels[inside]]
+        return out
+
+    def neighbor_pairs(self, labels):
+        ''' (i, n) for every neighbor n of labels[i], as flat arrays '''
+        labels = np.asarray(labels, dtype=np.int64)
+        counts = self.degree(labels)
+        i = np.repeat(np.arange(len(labels)), counts)
+        starts = np.zeros(len(labels), dtype=np.int64)
+        inside = labels < self.num_bins
+        starts[inside] = self.indptr[labels[inside]]
+        # t positions starts[i], starts[i] + 1, ... for every label
+        idx = (np.arange(counts.sum()) -
+               np.repeat(np.cumsum(counts) - counts - starts, counts))
+        return i, self.indices[idx]
+
+
+def _positions(store, labels):
+    ''' the segment of store holding each bin label, or -1 '''
+    if len(labels) == 0:
+        return np.zeros(0, dtype=np.int64)
+    lookup = np.full(max(int(store.keys.max()), int(labels.max())) + 1, -1,
+                     dtype=np.int64)
+    lookup[store.keys] = np.arange(len(store))
+    return lookup[labels]
+
+
+def neighbor_lookups(groups, graph):
+    ''' for every day group g of store.day_groups() and every neighbor n
+        of g's bin with events in the store, the group of n's latest day
+        before g's day, if it has one: returns (g, p, gap = day of g -
+        day of p) over those pairs. they fix which decay sums each day
+        needs from its neighbors, whatever omega is, so they are found
+        once per fit.
+    '''
+    if groups.num_events == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    seg = groups.segment_ids()
+    g, labels = graph.neighbor_pairs(groups.keys[seg])
+    bins = _positions(groups, labels)
+    g, bins = g[bins >= 0], bins[bins >= 0]
+    # t one sorted key, bin position then day, as in EventIndex
+    first = int(groups.days.min())
+    span = int(groups.days.max()) - first + 1
+    days = groups.days.astype(np.int64) - first
+    key = seg * span + days
+    p = np.searchsorted(key, bins * span + days[g]) - 1
+    before = p >= groups.offsets[bins]
+    g, p = g[before], p[before]
+    return g, p, (days[g] - days[p])
+
+
+def neighbor_sums(groups, counts, A, B, lookups, omega):
+    ''' the A and B of pp.calc_decay_sums, summed over the neighbors of
+        each day group instead of its own bin's earlier days
+    '''
+    g, p, gap = lookups
+    decay = np.exp(-omega * gap)
+    earlier = A[p] + counts[p]
+    AN = np.bincount(g, weights=decay * earlier, minlength=len(A))
+    BN = np.bincount(g, weights=decay * (B[p] + gap * earlier),
+                     minlength=len(A))
+    return AN, BN
+
+
+def make_engine(store, graph, T):
+    ''' like pp.make_engine's 'recursive' engine, with theta_n: returns
+        emstep(mu, theta, theta_n, omega) -> (omega, theta, theta_n, mu)
+        and loglik(mu, theta, theta_n, omega). time per step is linear in
+        the (bin, day)s times the neighbors of their bins.
+    '''
+    groups, counts = store.day_groups()
+    lookups = neighbor_lookups(groups, graph)
+    seg = groups.segment_ids()
+    num_events = store.num_events
+    # t every event has theta_n offspring in each of its bin's neighbors
+    exposure = np.dot(store.counts, graph.degree(store.keys))
+
+    def intensity(mu, theta, theta_n, omega):
+        A, B = pp.calc_decay_sums(groups, counts, omega)
+        AN, BN = neighbor_sums(groups, counts, A, B, lookups, omega)
+        mu_days = mu[seg]
+        return (mu_days + theta * omega * A + theta_n * omega * AN,
+                mu_days, A, B, AN, BN)
+
+    def emstep(mu, theta, theta_n, omega):
+        denom, mu_days, A, B, AN, BN = intensity(mu, theta, theta_n, omega)
+        own = counts * theta * omega / denom
+        near = counts * theta_n * omega / denom
+        sum_own = np.dot(own, A)
+        sum_near = np.dot(near, AN)
+        omega = (sum_own + sum_near) / (np.dot(own, B) + np.dot(near, BN))
+        theta = sum_own / num_events
+        theta_n = sum_near / exposure if exposure > 0 else 0.0
+        mu = np.add.reduceat(counts * mu_days / denom, groups.starts) / T
+        return omega, theta, theta_n, mu
+
+    def loglik(mu, theta, theta_n, omega):
+        denom = intensity(mu, theta, theta_n, omega)[0]
+        return (np.dot(counts, np.log(denom)) - T * np.sum(mu) -
+                theta * num_events - theta_n * exposure)
+
+    return emstep, loglik
+
+
+def fitEM(store, graph, T, omega, theta, theta_n, mu,
+          tol1=.00001, tol2=.00001, tol3=.0001, max_iter=None, strict=False):
+    ''' pp.fitEM for the spatial model; theta's tolerance applies to theta
+        and theta_n together. returns omega, theta, theta_n, mu and
+        dict(iterations, seconds, converged, loglik, setup_seconds).
+    '''
+    started = time.time()
+    emstep, loglik = make_engine(store, graph, T)
+    setup_seconds = time.time() - started
+    started = time.time()
+    omega_last = 10 + omega
+    theta_last = 10 + theta
+    theta_n_last = 10 + theta_n
+    mu_last = mu + 10
+    iterations = 0
+    converged = False
+
+    while True:
+        changes = [abs(omega - omega_last) > tol1,
+                   max(abs(theta - theta_last),
+                       abs(theta_n - theta_n_last)) > tol2,
+                   np.sum(np.abs(mu - mu_last)) > tol3]
+        converged = not (any(changes) if strict else all(changes))
+        if converged or (max_iter is not None and iterations >= max_iter):
+            break
+        omega_last = omega
+        theta_last = theta
+        theta_n_last = theta_n
+        mu_last = mu
+        omega, theta, theta_n, mu = emstep(mu, theta, theta_n, omega)
+        iterations += 1
+        assert omega < T * 1000
+
+    info = dict(iterations=iterations, seconds=time.time() - started,
+                converged=converged,
+                loglik=loglik(mu, theta, theta_n, omega),
+                setup_seconds=setup_seconds)
+    return omega, theta, theta_n, mu, info
+
+
+def scored_bins(store, graph, max_bin=None):
+    ''' the bins with events in store and their neighbors, ascending: the
+        neighbors' events raise the rates of bins with none of their own.
+        neighbors past max_bin are left out.
+    '''
+    labels = graph.neighbor_pairs(store.keys)[1]
+    if max_bin is not None:
+        labels = labels[labels <= max_bin]
+    return np.union1d(store.keys, labels)
+
+
+def calc_rates(store, graph, mu, theta, theta_n, omega, pred_day,
+               labels=None):
+    ''' pp.calc_rates with the neighbors' events: the intensity at day
+        number pred_day of every bin in labels, by default the bins of
+        store. mu is over the bins of store; a bin with no events there
+        has mu 0, its fitted value.
+    '''
+    if labels is None:
+        labels = store.keys
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(store) == 0:
+        return np.zeros(len(labels))
+    # t each bin's own kernel sum, as in pp.calc_rates
+    lags = pred_day - store.days.astype(np.int64)
+    own = np.add.reduceat(
+        np.where(lags > 0, np.exp(-omega * np.maximum(lags, 0)), 0.0),
+        store.starts)
+    # t then by label, 0 for the labels with no events in store
+    mine = _positions(store, labels)
+    has = mine >= 0
+    own_labels = np.zeros(len(labels))
+    own_labels[has] = own[mine[has]]
+    mu_labels = np.zeros(len(labels))
+    mu_labels[has] = np.asarray(mu)[mine[has]]
+    i, neighbors = graph.neighbor_pairs(labels)
+    near = _positions(store, neighbors)
+    keep = near >= 0
+    near_sums = np.bincount(i[keep], weights=own[near[keep]],
+                            minlength=len(labels))
+    return (mu_labels + theta * omega * own_labels +
+            theta_n * omega * near_sums)
+
+
+def runEM(data, graph, T, pred_date, k=20,
+          theta_init=1, theta_n_init=0.1, omega_init=1, mu_init=1,
+          tol1=.00001, tol2=.00001, tol3=.0001, init=None,
+          full_output=False, max_iter=None, max_bin=None):
+    ''' pp.runEM for the spatial model over graph. returns rates, tops,
+        omega, theta, theta_n, and with full_output=True the fit:
+        dict(omega, theta, theta_n, mu=dict[bin], bins), fitEM's
+        diagnostics and predict_seconds. the rates and tops are over
+        scored_bins(), listed in the fit's bins: the bins of data and
+        their neighbors, up to max_bin.
+        init is such a fit to start from; as in pp.runEM, a fit from it
+        stops only once every parameter has settled.
+    '''
+    if isinstance(data, es.EventStore):
+        store = data
+    else:
+        store = es.EventStore.from_dict(data)
+    keys = store.keys.tolist()
+    if init is None:
+        omega, theta, theta_n = omega_init, theta_init, theta_n_init
+        mu = np.full(len(store), mu_init, dtype=np.float64)
+    else:
+        omega, theta = init['omega'], init['theta']
+        theta_n = init.get('theta_n', theta_n_init)
+        mu = np.array([init['mu'].get(n, mu_init) for n in keys],
+                      dtype=np.float64)
+    omega, theta, theta_n, mu, info = fitEM(
+        store, graph, T, omega, theta, theta_n, mu, tol1, tol2, tol3,
+        max_iter, strict=init is not None)
+    started = time.time()
+    labels = scored_bins(store, graph, max_bin)
+    rates = calc_rates(store, graph, mu, theta, theta_n, omega,
+                       es.to_days([pred_date])[0], labels)
+    tops = pp.top_k(rates, labels, min(len(labels), k))
+    rates = rates.tolist()
+    if full_output:
+        fit = dict(omega=omega, theta=theta, theta_n=theta_n,
+                   mu=dict(zip(keys, mu)), bins=labels.tolist(),
+                   predict_seconds=time.time() - started, **info)
+        return rates, tops, omega, theta, theta_n, fit
+    return rates, tops, omega, theta, theta_n
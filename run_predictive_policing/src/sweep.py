@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# a grid of (predpol_window, begin_predpol, percent_increase) runs in one
+# go. before begin_predpol no crimes are added, so for a given window every
+# configuration follows the same trajectory up to its begin_predpol day.
+# that prefix is simulated once, on a trunk, and each configuration
+# branches off it on its own day and finishes on a process pool.
+
+
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import apply_predpol as ap
+import eventcache as ec
+from simulation import Simulation
+assert sys.version_info.major == 3
+
+
+def getargs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drug_crimes_with_bins", required=True)
+    parser.add_argument("--global_start", required=True)
+    parser.add_argument("--global_end", required=True)
+    parser.add_argument("--predictions", required=True)
+    parser.add_argument("--observed", required=True)
+    parser.add_argument("--predpol_window", required=True, type=int,
+                        nargs='+')
+    parser.add_argument("--begin_predpol", required=True, type=int,
+                        nargs='+')
+    parser.add_argument("--percent_increase", required=True, type=float,
+                        nargs='+')
+    parser.add_argument("--seed", required=True, type=int)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--cache_dir", default=None)
+    parser.add_argument("--formats", nargs='+', default=['csv'],
+                        choices=['csv', 'npz', 'parquet'])
+    return parser.parse_args(argv)
+
+
+def finish(sim):
+    ''' run a branch to the end, in a worker '''
+    return sim.run().results()
+
+
+def sweep(bins, days, max_bin, global_start, global_end, configs, seed,
+          processes=None, **options):
+    ''' run every configuration in configs, a list of dict(predpol_window,
+        begin_predpol, percent_increase), over the events (bins, days).
+        configuration j draws its added crimes from the j-th child of
+        np.random.SeedSequence(seed), so it matches a Simulation run on
+        its own with that generator. options go to every Simulation.
+        returns the results() of each configuration, in order.
+    '''
+    children = np.random.SeedSequence(seed).spawn(len(configs))
+    results = [None] * len(configs)
+    futures = dict()
+    with ProcessPoolExecutor(processes) as pool:
+        for window in sorted(set(c['predpol_window'] for c in configs)):
+            members = [j for j, c in enumerate(configs)
+                       if c['predpol_window'] == window]
+            # t the trunk never adds crimes, so it never draws from rng
+            trunk = Simulation(bins, days, max_bin, global_start,
+                               global_end, window, rng=None, verbose=False,
+                               **options)
+            # t adding 0% is the trunk, all the way to the end
+            flat = [j for j in members
+                    if configs[j]['percent_increase'] == 0]
+            branching = [j for j in members if j not in flat]
+            begins = sorted(set(configs[j]['begin_predpol']
+                                for j in branching))
+            for begin in begins:
+                trunk.run(until=begin)
+                for j in branching:
+                    if configs[j]['begin_predpol'] != begin:
+                        continue
+                    branch = trunk.branch(
+                        add_crimes_logical=True, begin_predpol=begin,
+                        percent_increase=configs[j]['percent_increase'],
+                        rng=np.random.default_rng(children[j]))
+                    futures[pool.submit(finish, branch)] = [j]
+            if flat:
+                futures[pool.submit(finish, trunk)] = flat
+        for future, js in futures.items():
+            for j in js:
+                results[j] = future.result()
+    return results
+
+
+def main(argv=None):
+    args = getargs(argv)
+    bins, days = ec.load_events(args.drug_crimes_with_bins, args.cache_dir)
+    max_bin = int(bins.max())
+    global_start = pd.to_datetime(args.global_start)
+    global_end = pd.to_datetime(args.global_end)
+    keep = ((days >= ap.day_number(global_start)) &
+            (days <= ap.day_number(global_end)))
+
+    configs = [dict(predpol_window=w, begin_predpol=b, percent_increase=p)
+               for w, b, p in itertools.product(args.predpol_window,
+                                                args.begin_predpol,
+                                                args.percent_increase)]
+    results = sweep(bins[keep], days[keep], max_bin,
+                    global_start, global_end, configs, args.seed,
+                    args.processes)
+
+    # output results, one pair of files per configuration and format
+    for config, result in zip(configs, results):
+        suffix = '_window{}_begin{}_add_{}percent.csv'.format(
+            config['predpol_window'], config['begin_predpol'],
+            int(config['percent_increase'] * 100))
+        ap.write_results(result, args.predictions + suffix,
+                         args.observed + suffix, args.formats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the batched replicates
+
+import unittest
+import numpy as np
+from simulation import Simulation
+from batched import BatchedSimulation
+from test_simulation import SimulationFrame
+
+
+class BatchedTest(SimulationFrame):
+    def batch(self, replicates, seed, percent_increase=0.5):
+        return BatchedSimulation(self.bins, self.days, 30, self.global_start,
+                                 self.global_end, 30, replicates,
+                                 percent_increase=percent_increase,
+                                 rng=np.random.default_rng(seed)).run()
+
+    def test_same_as_simulation(self):
+        ''' with nothing added, every replicate is the plain Simulation:
+            the same targets and iterations, and rates to rounding
+        '''
+        sim = Simulation(self.bins, self.days, 30, self.global_start,
+                         self.global_end, 30, verbose=False).run()
+        batch = self.batch(3, 0, percent_increase=0.0)
+        self.assertTrue(np.allclose(sim.rates, batch.rate_sum / 3))
+        for r in range(3):
+            self.assertTrue(np.array_equal(sim.targeted, batch.targeted[r]))
+            self.assertTrue(np.array_equal(sim.iterations,
+                                           batch.iterations[r]))
+        observed = sim.daily_counts.between(self.first + 30,
+                                            self.first + 59).sum(axis=1)
+        self.assertTrue(np.array_equal(observed, batch.observed()[1]))
+
+    def test_added_crimes(self):
+        ''' crimes only go to the top k bins of each replicate, and the
+            same seed gives the same trajectories
+        '''
+        batch = self.batch(4, 1)
+        self.assertTrue(np.all(batch.added[batch.targeted == 0] == 0))
+        self.assertGreater(batch.added.sum(), 0)
+        self.assertFalse(np.array_equal(batch.added[0], batch.added[1]))
+        again = self.batch(4, 1)
+        self.assertTrue(np.array_equal(batch.added, again.added))
+        self.assertTrue(np.array_equal(batch.rate_sum, again.rate_sum))
+
+
+if __name__ == '__main__':
+    unittest.main()
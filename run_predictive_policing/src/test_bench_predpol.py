@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the EM benchmarks
+
+import unittest
+import numpy as np
+import bench_predpol as bench
+
+
+class BenchTest(unittest.TestCase):
+    def test_scenarios(self):
+        rng = np.random.RandomState(0)
+        for name in bench.SCENARIOS:
+            data = bench.scenario_data(name, 5, 7, rng)
+            self.assertEqual(list(range(5)), list(data), name)
+            for days in data.values():
+                self.assertTrue(np.all(np.diff(days.astype(int)) >= 0))
+        uneven = bench.scenario_data('uneven', 5, 7, rng)
+        self.assertEqual([2, 3, 4, 5, 7], [len(v) for v in uneven.values()])
+
+    def test_run_case(self):
+        records = bench.run_case('clustered', 4, 5, repeat=1, max_iter=5)
+        self.assertEqual(['calc_tij', 'calc_pij', 'estep', 'mstep',
+                          'lambdafun', 'runEM[matrix]'],
+                         [r['function'] for r in records])
+        for r in records:
+            self.assertEqual(20, r['num_events'])
+            self.assertTrue(r['seconds'] >= 0 and r['peak_bytes'] > 0)
+        skipped = bench.run_case('even', 4, 50, max_bytes=1000)
+        self.assertIn('skipped', skipped[0])
+
+    def test_regressions(self):
+        old = [dict(scenario='even', bins=4, events=5, function=f,
+                    seconds=1.0) for f in ('estep', 'mstep', 'lambdafun')]
+        new = [dict(r, seconds=s) for r, s in zip(old, [1.05, 1.5, 0.5])]
+        compared = bench.compare(new, old)
+        self.assertEqual(3, len(compared))
+        slower = bench.regressions(compared, 0.1)
+        self.assertEqual([('even', 4, 5, 'mstep')], [k for k, _, _ in slower])
+        self.assertEqual(2, len(bench.regressions(compared, 0.01)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the command line entry point
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import eventstore as es
+import predpol as pp
+import cli
+
+# t imported by nothing on the hot path
+HEAVY = {'matplotlib', 'pylab', 'scipy'}
+# t imported by apply_predpol for --profile, --neighbors and --workers only
+OPTIONAL = {'cProfile', 'spatial', 'parallel', 'multiprocessing'}
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.RandomState(2)
+        self.bins = rng.randint(1, 16, size=300)
+        self.days = 14975 + rng.randint(60, size=300)
+        self.path = os.path.join(self.tmp.name, 'events.csv')
+        dates = self.days.astype('datetime64[D]').astype(object)
+        with open(self.path, 'w') as f:
+            f.write('"","bin","OCCURRED","LAG"\n')
+            for i, (b, date) in enumerate(zip(self.bins, dates)):
+                f.write('"{}",{},"{}",0\n'.format(
+                    i + 1, b, date.strftime('%m/%d/%y')))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fit(self):
+        ''' fit is runEM on the window before --end '''
+        output = os.path.join(self.tmp.name, 'rates.csv')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            cli.main(['fit', '--drug_crimes_with_bins', self.path,
+                      '--end', '2011/02/01', '--predpol_window', '30',
+                      '--k', '5', '--output', output])
+        end = es.to_days(['2011-02-01'])[0]
+        keep = (self.days >= end - 30) & (self.days < end)
+        store = es.EventStore.from_arrays(self.bins[keep], self.days[keep])
+        rates, tops, _, _ = pp.runEM(store, 30, np.datetime64('2011-02-01'),
+                                     k=5)
+        self.assertEqual(' '.join(str(n) for n in tops),
+                         out.getvalue().splitlines()[-1])
+        written = np.loadtxt(output, delimiter=',', skiprows=1)
+        self.assertTrue(np.array_equal(store.keys, written[:, 0]))
+        self.assertTrue(np.array_equal(rates, written[:, 1]))
+
+    def test_fit_imports(self):
+        ''' fit starts without pandas; how long it takes is left to
+            cli.py startup, which a busy machine can't fail by accident
+        '''
+        modules = set(cli.import_seconds('fit')[1])
+        self.assertFalse((HEAVY | {'pandas'}) & modules)
+
+    def test_simulate_imports(self):
+        ''' simulate leaves the options it isn't given unimported '''
+        modules = set(cli.import_seconds('simulate')[1])
+        self.assertFalse((HEAVY | OPTIONAL) & modules)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the daily count matrix
+
+import unittest
+import numpy as np
+from counts import DailyCounts
+
+
+class DailyCountsTest(unittest.TestCase):
+    def setUp(self):
+        self.bins = np.random.randint(1, 6, size=200)
+        self.days = np.random.randint(30, size=200) + 15000
+        self.counts = DailyCounts(self.bins, self.days, 5, 15000, 30)
+
+    def test_counts(self):
+        for b in range(1, 6):
+            for d in [15000, 15013, 15029]:
+                expected = np.sum((self.bins == b) & (self.days == d))
+                self.assertEqual(expected, self.counts.on([b], d)[0])
+        self.assertEqual(200, self.counts.counts.sum())
+        self.assertEqual(0, self.counts.counts[0].sum())
+
+    def test_add(self):
+        ''' added events show up in slices taken before the add '''
+        before = self.counts.on([2, 4], 15010)
+        block = self.counts.between(15010, 15012)
+        self.counts.add([2, 4, 2], 15010, [1, 3, 2])
+        self.assertEqual([before[0] + 3, before[1] + 3],
+                         list(block[[2, 4], 0]))
+        self.assertEqual((6, 2), block.shape)
+
+    def test_from_counts(self):
+        ''' a copy: adding to it leaves the counts it came from alone '''
+        shared = self.counts.counts.copy()
+        shared.flags.writeable = False
+        copy = DailyCounts.from_counts(shared, 15000)
+        self.assertTrue(np.array_equal(self.counts.on([1, 3], 15020),
+                                       copy.on([1, 3], 15020)))
+        copy.add([3], 15020, [5])
+        self.assertEqual(shared[3, 20] + 5, copy.on([3], 15020)[0])
+        self.assertTrue(np.array_equal(self.counts.counts, shared))
+
+
+if __name__ == '__main__':
+    unittest.main()
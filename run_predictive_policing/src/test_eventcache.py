@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the event table cache
+
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import eventcache as ec
+
+
+class EventCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tmp.name, 'cache')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_csv(self, name, rows):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as f:
+            f.write('"","bin","OCCURRED","LAG"\n')
+            for i, (b, date) in enumerate(rows):
+                f.write('"{}",{},"{}",0\n'.format(i + 1, b, date))
+        return path
+
+    def test_hit_matches_parse(self):
+        path = self.write_csv('a.csv', [(3, '01/02/10'), ('NA', '01/03/10'),
+                                        (1, '12/31/10')])
+        bins, days = ec.parse_events(path)
+        self.assertEqual([3, 1], list(bins))
+        self.assertEqual(np.int32, days.dtype)
+        self.assertEqual([14611, 14974], list(days))
+        for _ in range(2):
+            cached = ec.load_events(path, self.cache)
+            self.assertIsInstance(cached[0], np.memmap)
+            self.assertTrue(np.array_equal(bins, cached[0]))
+            self.assertTrue(np.array_equal(days, cached[1]))
+        self.assertEqual([ec.file_hash(path)], os.listdir(self.cache))
+
+    def test_evicts_least_recently_used(self):
+        paths = [self.write_csv('{}.csv'.format(i), [(i + 1, '01/02/10')] * 50)
+                 for i in range(3)]
+        ec.load_events(paths[0], self.cache)
+        size = ec.entry_size(os.path.join(self.cache, ec.file_hash(paths[0])))
+        ec.load_events(paths[1], self.cache)
+        # t use the first again, so the second is the oldest
+        time.sleep(0.01)
+        ec.load_events(paths[0], self.cache)
+        ec.load_events(paths[2], self.cache, max_bytes=2 * size)
+        self.assertEqual(sorted(ec.file_hash(p) for p in [paths[0], paths[2]]),
+                         sorted(os.listdir(self.cache)))
+
+
+if __name__ == '__main__':
+    unittest.main()
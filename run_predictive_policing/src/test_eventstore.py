@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the packed event store
+
+import unittest
+import pandas as pd
+import numpy as np
+import predpol as pp
+import eventstore as es
+
+
+class EventStoreTestPack(unittest.TestCase):
+    def setUp(self):
+        start_date = pd.datetime(2012, 1, 1)
+        self.data = {
+            7: [start_date + pd.DateOffset(i) for i in [0, 2, 2, 5]],
+            3: [start_date + pd.DateOffset(i) for i in [4]],
+            5: [start_date + pd.DateOffset(i) for i in [1, 3, 9]],
+        }
+        self.store = es.EventStore.from_dict(self.data)
+
+    def test_layout(self):
+        self.assertEqual([7, 3, 5], list(self.store.keys))
+        self.assertEqual([0, 4, 5, 8], list(self.store.offsets))
+        self.assertEqual([0, 0, 0, 0, 1, 2, 2, 2],
+                         list(self.store.segment_ids()))
+        day0 = es.to_days([pd.datetime(2012, 1, 1)])[0]
+        self.assertEqual([0, 2, 2, 5], list(self.store.events(0) - day0))
+
+    def test_from_arrays(self):
+        ''' same events in any order pack the same, with sorted bins '''
+        bins = np.repeat(self.store.keys, self.store.counts)
+        order = np.random.permutation(len(bins))
+        store = es.EventStore.from_arrays(bins[order],
+                                          self.store.days[order])
+        self.assertEqual([3, 5, 7], list(store.keys))
+        self.assertTrue(np.array_equal(self.store.events(0), store.events(2)))
+
+    def test_pairs(self):
+        ''' pairs are the positive cells of calc_tij, bin after bin '''
+        rows, lags = self.store.pairs()
+        tij = pp.calc_tij(self.data)
+        expected = np.concatenate([tij[n][tij[n] > 0] for n in self.data])
+        self.assertTrue(np.array_equal(expected, lags))
+        # rows point at the later event of each pair
+        self.assertEqual([1, 2, 3, 3, 3, 6, 7, 7], list(rows))
+
+    def test_band(self):
+        ''' pairs(max_lag) are the pairs with lags up to max_lag, in order '''
+        rows, lags = self.store.pairs()
+        for max_lag in [0, 1, 3, 10 ** 6]:
+            keep = lags <= max_lag
+            band_rows, band_lags = self.store.pairs(max_lag)
+            self.assertTrue(np.array_equal(rows[keep], band_rows))
+            self.assertTrue(np.array_equal(lags[keep], band_lags))
+
+
+
+class EventIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.bins = np.random.randint(10, size=500)
+        self.days = np.random.randint(100, size=500) + 15000
+        self.index = es.EventIndex(self.bins, self.days)
+
+    def _check(self, start, end):
+        keep = (self.days >= start) & (self.days < end)
+        expected = es.EventStore.from_arrays(self.bins[keep],
+                                             self.days[keep])
+        window = self.index.window(start, end)
+        self.assertTrue(np.array_equal(expected.keys, window.keys))
+        self.assertTrue(np.array_equal(expected.offsets, window.offsets))
+        self.assertTrue(np.array_equal(expected.days, window.days))
+
+    def test_window(self):
+        ''' searchsorted windows match filtering every event '''
+        for start, end in [(15010, 15040), (14000, 15050), (15090, 16000),
+                           (15050, 15050), (15000, 15001)]:
+            self._check(start, end)
+
+    def test_add(self):
+        ''' added events show up in windows; the real ones stay apart '''
+        new_bins = np.array([42, 3, 3])
+        new_days = np.array([15050, 15099, 15120])
+        for b, d in zip(new_bins, new_days):
+            self.index.add([b], [d])
+        original = self.index.window(15040, 15121, injected=False)
+        self.bins = np.concatenate([self.bins, new_bins])
+        self.days = np.concatenate([self.days, new_days])
+        self._check(15040, 15121)
+        self.assertEqual(503, len(self.index))
+        self.assertEqual([42, 3, 3], list(self.index.injected.bins))
+        self.assertEqual(self.index.store.num_events, 500)
+        self.assertEqual(original.num_events + 3,
+                         self.index.window(15040, 15121).num_events)
+
+    def test_buffer_grows(self):
+        buf = es.EventBuffer(capacity=2)
+        for day in range(15000, 15010):
+            buf.append([1, 2, 3], [day] * 3)
+        self.assertEqual(30, len(buf))
+        self.assertTrue(len(buf._days) < 60)
+        self.assertEqual(list(np.repeat(range(15000, 15010), 3)),
+                         list(buf.days))
+        self.assertEqual((3, 9), buf.bounds(15001, 15003))
+        with self.assertRaises(AssertionError):
+            buf.append([1], [14999])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the compiled EM kernels
+
+import unittest
+import numpy as np
+import predpol as pp
+import eventstore as es
+import kernels
+
+
+def plain(fn):
+    ''' the python function under a kernel, compiled or not, so the loops
+        are checked the same with and without numba
+    '''
+    return getattr(fn, 'py_func', fn)
+
+
+class KernelsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.store = es.EventStore.from_arrays(
+            rng.randint(15, size=200), rng.randint(60, size=200) + 15000)
+        self.groups, self.counts = self.store.day_groups()
+        self.mu = rng.rand(len(self.store)) + 0.1
+        self.args = (self.groups.offsets, self.groups.days, self.counts)
+
+    def test_emstep(self):
+        omega, theta, mu = plain(kernels.emstep)(*self.args, self.mu, 0.3,
+                                                 0.4, 60)
+        expected = pp.emstep_recursive(self.groups, self.counts, self.mu,
+                                       0.3, 0.4, 60)
+        self.assertTrue(np.isclose(expected[0], omega))
+        self.assertTrue(np.isclose(expected[1], theta))
+        self.assertTrue(np.allclose(expected[2], mu))
+
+    def test_loglik(self):
+        loglik = plain(kernels.loglik)(*self.args, self.mu, 0.3, 0.4, 60)
+        expected = pp.make_engine(self.store, 60, 'recursive')[1](
+            self.mu, 0.3, 0.4)
+        self.assertTrue(np.isclose(expected, loglik))
+
+    def test_rates(self):
+        rates = plain(kernels.rates)(self.store.offsets, self.store.days,
+                                     self.mu, 0.3, 0.4, 15030)
+        lags = 15030 - self.store.days
+        epart = np.where(lags > 0, np.exp(-0.4 * np.maximum(lags, 0)), 0)
+        expected = self.mu + 0.3 * 0.4 * np.add.reduceat(epart,
+                                                         self.store.starts)
+        self.assertTrue(np.allclose(expected, rates))
+
+    def test_jit_engine(self):
+        ''' the jit engine fits what the recursive one does, compiled or,
+            without numba, by being it
+        '''
+        mu = np.ones(len(self.store))
+        jit = pp.fitEM(self.store, 60, 1.0, 0.5, mu, engine='jit')
+        recursive = pp.fitEM(self.store, 60, 1.0, 0.5, mu,
+                             engine='recursive')
+        self.assertTrue(np.isclose(recursive[0], jit[0]))
+        self.assertTrue(np.isclose(recursive[1], jit[1]))
+        self.assertTrue(np.allclose(recursive[2], jit[2]))
+
+    def test_auto_engine(self):
+        ''' the default engine runs the kernels whenever they're on, and
+            the numpy 'matrix' engine when they're not
+        '''
+        mu = np.ones(len(self.store))
+        enabled = kernels.ENABLED
+        try:
+            # t without numba the kernels run as plain python
+            kernels.ENABLED = True
+            auto = pp.make_engine(self.store, 60)[0](mu, 0.5, 1.0)
+            jit = pp.make_engine(self.store, 60, 'jit')[0](mu, 0.5, 1.0)
+            self.assertEqual(jit[0], auto[0])
+            self.assertTrue(np.array_equal(jit[2], auto[2]))
+            kernels.ENABLED = False
+            auto = pp.make_engine(self.store, 60)[0](mu, 0.5, 1.0)
+            matrix = pp.make_engine(self.store, 60, 'matrix')[0](mu, 0.5,
+                                                                 1.0)
+            self.assertEqual(matrix[0], auto[0])
+            self.assertTrue(np.array_equal(matrix[2], auto[2]))
+        finally:
+            kernels.ENABLED = enabled
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the online EM
+
+import unittest
+import numpy as np
+import predpol as pp
+import eventstore as es
+from online import OnlineEM
+
+
+class OnlineEMTest(unittest.TestCase):
+    def setUp(self):
+        # t bursts: each background event brings a few the next days
+        rng = np.random.RandomState(7)
+        bins, days = [], []
+        for b in range(1, 21):
+            for d in np.flatnonzero(rng.rand(120) < 0.02 * (1 + b % 4)):
+                extra = rng.poisson(1.5)
+                bins.extend([b] * (1 + extra))
+                days.extend([d] + list(d + 1 + rng.randint(3, size=extra)))
+        self.bins = np.array(bins)
+        self.days = np.array(days) + 15000
+        self.window = 60
+
+    def _feed(self, model, upto):
+        for d in range(15000, upto + 1):
+            model.ingest(d, self.bins[self.days == d])
+
+    def _batch(self, last):
+        keep = (self.days > last - self.window) & (self.days <= last)
+        store = es.EventStore.from_arrays(self.bins[keep], self.days[keep])
+        return store, pp.runEM(store, self.window,
+                               np.datetime64(last + 1, 'D'), k=5,
+                               full_output=True)
+
+    def test_window(self):
+        ''' only the last `window` days count '''
+        model = OnlineEM(self.window)
+        self._feed(model, 15099)
+        store, _ = self._batch(15099)
+        labels, rates = model.rates()
+        self.assertEqual(list(store.keys), list(labels))
+        self.assertEqual(list(store.counts), list(model._count[labels]))
+
+    def test_anchor(self):
+        ''' anchored, the rankings and rates are runEM's '''
+        model = OnlineEM(self.window)
+        self._feed(model, 15099)
+        fit = model.anchor()
+        self.assertEqual(fit['omega'], model.omega)
+        store, (rates, tops, omega, theta, batch) = self._batch(15099)
+        # t the anchor starts from the online fit, so stops elsewhere
+        self.assertAlmostEqual(omega, model.omega, places=3)
+        self.assertAlmostEqual(theta, model.theta, places=3)
+        mu = np.array([fit['mu'][n] for n in store.keys])
+        expected = pp.calc_rates(store, mu, fit['theta'], fit['omega'],
+                                 15100)
+        self.assertTrue(np.allclose(expected, model.rates()[1]))
+        self.assertEqual(pp.top_k(expected, store.keys, 5), model.top_k(5))
+
+    def test_tracks_batch(self):
+        ''' ingesting day by day after an anchor stays near the batch fit '''
+        model = OnlineEM(self.window)
+        self._feed(model, 15069)
+        model.anchor()
+        for d in range(15070, 15110):
+            model.ingest(d, self.bins[self.days == d])
+        _, (rates, tops, omega, theta, _) = self._batch(15109)
+        self.assertTrue(theta > 0.2)
+        # t earlier days' statistics keep the parameters of their day
+        self.assertTrue(abs(model.theta - theta) < 0.2 * theta)
+        self.assertTrue(abs(model.omega - omega) < 0.25 * omega)
+        self.assertTrue(len(set(tops) & set(model.top_k(5))) >= 3)
+
+    def test_bounded(self):
+        ''' only the window's events are kept, however long it runs '''
+        model = OnlineEM(self.window)
+        self._feed(model, 15119)
+        self.assertTrue(all(day > 15119 - self.window
+                            for day, _ in model.events))
+        store = model.window_store()
+        batch, _ = self._batch(15119)
+        self.assertEqual(batch.num_events, store.num_events)
+        self.assertTrue(np.array_equal(batch.days, store.days))
+
+
+if __name__ == '__main__':
+    unittest.main()
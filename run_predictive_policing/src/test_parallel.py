@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the day-parallel runs
+
+import unittest
+import numpy as np
+import parallel
+from simulation import Simulation
+from test_simulation import SimulationFrame
+
+
+class ParallelTest(SimulationFrame):
+    def simulation(self, **kwargs):
+        return Simulation(self.bins, self.days, 30, self.global_start,
+                          self.global_end, 30, verbose=False, **kwargs)
+
+    def test_same_as_serial(self):
+        ''' with cold starts, the workers' days are the serial run's '''
+        serial = self.simulation(warm_start=False).run().results()
+        spread = parallel.run(self.simulation(warm_start=False),
+                              3).results()
+        self.assertTrue(serial['rates'].equals(spread['rates']))
+        self.assertTrue(serial['observed'].equals(spread['observed']))
+        self.assertTrue(np.array_equal(serial['targeted'],
+                                       spread['targeted']))
+        self.assertTrue(np.array_equal(
+            serial['em_iterations'].iterations,
+            spread['em_iterations'].iterations))
+
+    def test_from_part_way(self):
+        ''' a simulation already part way through runs the rest '''
+        serial = self.simulation(warm_start=False).run()
+        sim = parallel.run(self.simulation(warm_start=False).run(until=7),
+                           2)
+        self.assertEqual(serial.i, sim.i)
+        self.assertTrue(np.array_equal(serial.rates, sim.rates))
+        self.assertTrue(np.array_equal(serial.targeted, sim.targeted))
+
+    def test_no_added_crimes(self):
+        sim = self.simulation(add_crimes_logical=True, percent_increase=0.1,
+                              warm_start=False)
+        with self.assertRaises(AssertionError):
+            parallel.run(sim, 2)
+
+    def test_no_warm_start(self):
+        ''' warm starts chain the days, so they can't be split '''
+        with self.assertRaises(AssertionError):
+            parallel.run(self.simulation(warm_start=True), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
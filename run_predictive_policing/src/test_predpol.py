@@ -16,9 +16,11 @@
 # - figure out why one test fails when we append 1 to pj
 
 import unittest
+import copy
 import pandas as pd
 import numpy as np
 import predpol as pp
+import eventstore as es
 
 
 def run_EM(crime_data, start_date):
@@ -33,6 +35,38 @@ def run_EM(crime_data, start_date):
         return {'rates': rates, 'tops': tops, 'omega': omega, 'theta': theta}
 
 
+#t the event patterns of the cases below, sized by num_bins and n events
+#t per bin. each returns dict[bin] -> sorted day shifts from a start date;
+#t bench_predpol times the EM on the same patterns at larger sizes.
+def even_shifts(num_bins, n, rng=np.random):
+    ''' one event every 3 days in every bin '''
+    return dict((i, [j * 3 for j in range(n)]) for i in range(num_bins))
+
+
+def rough_shifts(num_bins, n, rng=np.random):
+    ''' the same n random days of a year (or of n days) in every bin '''
+    shifts = sorted(rng.randint(max(365, n), size=n).tolist())
+    return dict((i, shifts) for i in range(num_bins))
+
+
+def uneven_shifts(num_bins, n, rng=np.random):
+    ''' bin i has i + 2 random days, scaled so the last bin has n '''
+    sizes = np.linspace(2, max(n, 2), num_bins).astype(int)
+    return dict((i, sorted(rng.randint(max(365, n), size=size).tolist()))
+                for i, size in enumerate(sizes))
+
+
+def clustered_shifts(num_bins, n, rng=np.random):
+    ''' bin i has n events on days i, i+1, ..., i+n-1 '''
+    return dict((i, [i + j for j in range(n)]) for i in range(num_bins))
+
+
+def shifted(start_date, shifts):
+    ''' dict[bin] -> shifts as dict[bin] -> timestamps from start_date '''
+    return dict((i, [start_date + pd.DateOffset(shift) for shift in v])
+                for i, v in shifts.items())
+
+
 class PredpolTestCase(unittest.TestCase):
     # crime_data is a dict of locations, ie., bins,
     # each of which has a vector of timestamps denoting crime occurrences.
@@ -68,16 +102,13 @@ class PredpolTestEvenExact(PredpolTestCase):
     #t inherits setUp(). What I've done is change the behavior of the
     #t superclass's setUp.
     def _gen_data(self):
-        self.crime_data = dict()
         self._make_shifts()
-        for i in range(self.num_bins):
-            self.crime_data[i] = [self.start_date + pd.DateOffset(shift) for
-                                  shift in self.shifts]
+        self.crime_data = shifted(self.start_date, self.shifts)
 
     def _make_shifts(self):
         # made the time period longer to verify this gets closer to 1/3,
         # to avoid "edge effects"
-        self.shifts = [j * 3 for j in range(100)]
+        self.shifts = even_shifts(self.num_bins, 100)
 
     def test_rates(self):
         mean_rate = np.mean(self.results['rates'])
@@ -107,7 +138,7 @@ class PredpolTestEvenRough(PredpolTestEvenExact):
     #t behavior of PredpolTestEvenExact._gen_data(), and which in turn,
     #t changes the behavior of PredpolTestCase.doSetup
     def _make_shifts(self):
-        self.shifts = sorted(np.random.randint(365, size=80))
+        self.shifts = rough_shifts(self.num_bins, 80)
 
     def test_rates(self):
         mean_rate = np.mean(self.results['rates'])
@@ -133,11 +164,8 @@ class PredpolTestUneven(PredpolTestCase):
     #t This is *not* a subclass of PredpolTestEvenExact, which is what the
     #t previous class was.
     def _gen_data(self):
-        self.crime_data = dict()
-        for i in range(self.num_bins):
-            shifts = sorted(np.random.randint(365, size=i+2))
-            self.crime_data[i] = [self.start_date + pd.DateOffset(shift)
-                                  for shift in shifts]
+        self.crime_data = shifted(
+            self.start_date, uneven_shifts(self.num_bins, self.num_bins + 1))
 
     def test_rates(self):
         diffs = np.diff(self.results['rates'])
@@ -160,11 +188,8 @@ class PredpolTestClustered(PredpolTestCase):
     #t again we're inheriting from PredpolTestCase, so we need to define
     #t _gen_data.
     def _gen_data(self):
-        self.crime_data = dict()
-        for i in range(self.num_bins):
-            bin_start = self.start_date + pd.DateOffset(i)
-            self.crime_data[i] = [bin_start + pd.DateOffset(j)
-                                  for j in range(10)]
+        self.crime_data = shifted(self.start_date,
+                                  clustered_shifts(self.num_bins, 10))
 
     def test_rates(self):
         diffs = np.diff(self.results['rates'])
@@ -241,6 +266,16 @@ class PredpolTestCalcpij(unittest.TestCase):
                 'pij[0] is \n{}'.format(pij[0])
         )
 
+    def test_same_day_pairs(self):
+        ''' events on the same day have zero lag and trigger nothing '''
+        start_date = pd.datetime(2012, 1, 1)
+        data = {0: [start_date, start_date, start_date + pd.DateOffset(2)]}
+        tij = pp.calc_tij(data)
+        self.assertTrue(np.array_equal(tij[0], [[0, 0], [2, 2]]))
+        pij = pp.calc_pij(tij, theta=0.5, omega=1)
+        self.assertEqual(0, pij[0][0, 0])
+        self.assertTrue(np.allclose(pij[0][1], 0.5 * np.exp(-2)))
+
 
 class PredpolTestEstep(unittest.TestCase):
     def test_calc_estep(self):
@@ -272,6 +307,36 @@ class PredpolTestEstep(unittest.TestCase):
         self.assertTrue(np.allclose(handpj, pj[0], atol=0.005))
 
 
+class PredpolTestEstepRows(unittest.TestCase):
+    ''' each event's triggering probabilities and background probability
+        add to 1, with events on different days and uneven gaps, so each
+        row has a different denominator
+    '''
+    def test_rows_sum_to_one(self):
+        start_date = pd.datetime(2012, 1, 1)
+        data = {0: [start_date + pd.DateOffset(i) for i in [0, 1, 4, 5, 9]],
+                1: [start_date + pd.DateOffset(i) for i in [2, 3, 3]]}
+        tij = pp.calc_tij(data)
+        mu = {0: 0.3, 1: 0.7}
+        pij, pj = pp.estep(data, mu=mu, theta=0.5, omega=0.4, tij=tij)
+        for n in data:
+            rowsums = np.sum(pij[n], axis=1) + pj[n][:-1]
+            self.assertTrue(np.allclose(rowsums, 1))
+
+    def test_matches_packed(self):
+        start_date = pd.datetime(2012, 1, 1)
+        data = {0: [start_date + pd.DateOffset(i) for i in [0, 1, 4, 5, 9]]}
+        tij = pp.calc_tij(data)
+        pij, pj = pp.estep(data, mu={0: 0.3}, theta=0.5, omega=0.4, tij=tij)
+        store = es.EventStore.from_dict(data)
+        rows, lags = store.pairs()
+        packed_pij, _ = pp.estep_packed(store, np.array([0.3]), 0.5, 0.4,
+                                        rows, lags)
+        # t the pairs of row i of the dict version are its nonzero entries
+        dense = pij[0][np.tril_indices(len(data[0]) - 1)]
+        self.assertTrue(np.allclose(np.sort(dense), np.sort(packed_pij)))
+
+
 class PredpolTestMstep(unittest.TestCase):
     def test_calc_mstep(self):
         start_date = pd.datetime(2012, 1, 1)
@@ -287,5 +352,270 @@ class PredpolTestMstep(unittest.TestCase):
         self.assertTrue(np.isclose(0.8410, mu[0], atol=0.01))
 
 
+
+class PredpolPackedFrame(unittest.TestCase):
+    ''' random small bins, as a dict and as an EventStore '''
+    def setUp(self):
+        start_date = pd.datetime(2012, 1, 1)
+        self.data = dict()
+        for i in range(10):
+            shifts = sorted(np.random.randint(60, size=i + 1))
+            self.data[i] = [start_date + pd.DateOffset(shift)
+                            for shift in shifts]
+        self.store = es.EventStore.from_dict(self.data)
+
+
+class PredpolTestPacked(PredpolPackedFrame):
+    ''' the packed E/M steps agree with the dict-of-lists versions '''
+    def test_packed_steps(self):
+        tij = pp.calc_tij(self.data)
+        mu = dict((n, 0.5) for n in self.data)
+        pij, pj = pp.estep(self.data, mu=mu, theta=0.5, omega=1, tij=tij)
+        omega, theta, mu = pp.mstep(pij, pj, tij, self.data, T=60)
+
+        rows, lags = self.store.pairs()
+        packed_pij, packed_pj = pp.estep_packed(
+            self.store, np.full(len(self.store), 0.5), 0.5, 1, rows, lags)
+        self.assertTrue(np.allclose(
+            np.sum(packed_pij), sum(np.sum(p) for p in pij.values())))
+        packed = pp.mstep_packed(self.store, packed_pij, packed_pj, lags, T=60)
+        self.assertTrue(np.isclose(omega, packed[0]))
+        self.assertTrue(np.isclose(theta, packed[1]))
+        self.assertTrue(np.allclose([mu[n] for n in self.data], packed[2]))
+
+
+class PredpolTestRecursive(PredpolPackedFrame):
+    ''' the recursive engine matches the pairwise one without pairs '''
+    def test_decay_sums(self):
+        groups, counts = self.store.day_groups()
+        A, B = pp.calc_decay_sums(groups, counts, omega=0.3)
+        rows, lags = self.store.pairs()
+        kernel = np.exp(-0.3 * lags)
+        # every event on a day gets its day's sums
+        per_event = np.repeat(np.arange(len(counts)), counts)
+        n = self.store.num_events
+        self.assertTrue(np.allclose(
+            A[per_event], np.bincount(rows, weights=kernel, minlength=n)))
+        self.assertTrue(np.allclose(
+            B[per_event],
+            np.bincount(rows, weights=kernel * lags, minlength=n)))
+
+    def test_engines_agree(self):
+        pred_date = pd.datetime(2012, 3, 1)
+        matrix = pp.runEM(copy.deepcopy(self.data), 60, pred_date,
+                          engine='matrix')
+        recursive = pp.runEM(copy.deepcopy(self.data), 60, pred_date,
+                             engine='recursive')
+        self.assertTrue(np.allclose(matrix[0], recursive[0], rtol=1e-10))
+        self.assertEqual(matrix[1], recursive[1])
+        self.assertTrue(np.isclose(matrix[2], recursive[2], rtol=1e-10))
+        self.assertTrue(np.isclose(matrix[3], recursive[3], rtol=1e-10))
+
+
+class PredpolTestBanded(PredpolPackedFrame):
+    ''' the banded engines drop only pairs the kernel has decayed away '''
+    def test_horizon(self):
+        horizon = pp.band_horizon(0.5, 1e-4)
+        self.assertGreaterEqual(np.exp(-0.5 * horizon), 1e-4)
+        self.assertLess(np.exp(-0.5 * (horizon + 1)), 1e-4)
+
+    def test_same_fit(self):
+        mu = np.ones(len(self.store))
+        full = pp.fitEM(self.store, 60, 1.0, 0.5, mu)
+        for engine in ['banded', 'banded32']:
+            banded = pp.fitEM(self.store, 60, 1.0, 0.5, mu, engine=engine)
+            self.assertTrue(np.isclose(full[0], banded[0], rtol=1e-4))
+            self.assertTrue(np.isclose(full[1], banded[1], rtol=1e-4))
+            self.assertTrue(np.allclose(full[2], banded[2], rtol=1e-4))
+            self.assertLess(abs(banded[3]['loglik_error']), 1e-4)
+
+    def test_loglik_error(self):
+        ''' a loose tolerance cuts pairs that matter, and says so '''
+        mu = np.ones(len(self.store))
+        exact = pp.make_engine(self.store, 60)[1](mu, 0.5, 0.1)
+        loglik = pp.make_engine(self.store, 60, 'banded', band_tol=0.5)[1]
+        self.assertLess(loglik(mu, 0.5, 0.1), exact)
+        fit = pp.fitEM(self.store, 60, 0.1, 0.5, mu, engine='banded',
+                       band_tol=0.5, max_iter=1)
+        self.assertLess(fit[3]['loglik_error'], 0)
+
+
+class PredpolTestWarmStart(PredpolPackedFrame):
+    def test_warm_start(self):
+        ''' restarting from a converged fit takes fewer iterations than
+            settling every parameter from scratch does
+        '''
+        pred_date = pd.datetime(2012, 3, 1)
+        cold = pp.runEM(copy.deepcopy(self.data), 60, pred_date,
+                        full_output=True)
+        fit = cold[4]
+        self.assertEqual(set(self.data), set(fit['mu']))
+        warm = pp.runEM(copy.deepcopy(self.data), 60, pred_date,
+                        init=fit, full_output=True)
+        settled = pp.fitEM(self.store, 60, 1, 1, np.ones(len(self.store)),
+                           strict=True)[3]
+        self.assertLess(warm[4]['iterations'], settled['iterations'])
+        self.assertTrue(np.allclose(cold[0], warm[0], atol=0.001))
+
+    def test_new_bins(self):
+        ''' bins the previous fit never saw start from mu_init '''
+        pred_date = pd.datetime(2012, 3, 1)
+        init = dict(omega=1, theta=0.5, mu={0: 0.1})
+        results = pp.runEM(copy.deepcopy(self.data), 60, pred_date,
+                           init=init, full_output=True)
+        self.assertEqual(len(self.data), len(results[4]['mu']))
+
+
+class PredpolTestNextWindow(unittest.TestCase):
+    ''' the simulation's warm start: tomorrow's window fit from today's '''
+    def setUp(self):
+        # t bins of different rates; each event brings about one more
+        rng = np.random.RandomState(0)
+        bins, days = [], []
+        for b in range(20):
+            for d in np.flatnonzero(rng.rand(100) < 0.02 * (1 + b % 5)):
+                extra = rng.poisson(1)
+                bins.extend([b] * (1 + extra))
+                days.extend([d] + list(d + 1 + rng.randint(3, size=extra)))
+        self.bins = np.array(bins)
+        self.days = np.array(days) + 15000
+
+    def window(self, start):
+        keep = (self.days >= start) & (self.days < start + 60)
+        store = es.EventStore.from_arrays(self.bins[keep], self.days[keep])
+        return store, np.datetime64(start + 60, 'D')
+
+    def test_same_top_k(self):
+        ''' warm, the fit ranks the bins as a cold fit does, and takes more
+            than the one step that already moves one parameter by less
+            than its tolerance
+        '''
+        store, pred_date = self.window(15020)
+        before = pp.runEM(store, 60, pred_date, full_output=True)[4]
+        store, pred_date = self.window(15021)
+        cold = pp.runEM(store, 60, pred_date, k=5)
+        warm = pp.runEM(store, 60, pred_date, k=5, init=before,
+                        full_output=True)
+        self.assertEqual(cold[1], warm[1])
+        self.assertTrue(np.allclose(cold[0], warm[0], rtol=1e-3))
+        self.assertGreater(warm[4]['iterations'], 1)
+
+
+class PredpolTestAccelerated(PredpolPackedFrame):
+    def _fit(self, **kwargs):
+        return pp.fitEM(self.store, 60, 1.0, 1.0,
+                        np.ones(len(self.store)), **kwargs)
+
+    def test_same_fixed_point(self):
+        ''' SQUAREM lands where plain EM does, in fewer steps.
+            uses clustered bins: with theta near 0, omega is barely
+            identified and the two can stop at different omegas.
+        '''
+        start_date = pd.datetime(2012, 1, 1)
+        self.store = es.EventStore.from_dict(dict(
+            (i, [start_date + pd.DateOffset(i + j) for j in range(10)])
+            for i in range(20)))
+        tight = dict(tol1=1e-10, tol2=1e-10, tol3=1e-10, max_iter=10000)
+        plain = self._fit(**tight)
+        fast = self._fit(accelerate=True, **tight)
+        self.assertTrue(plain[3]['converged'] and fast[3]['converged'])
+        self.assertLessEqual(fast[3]['iterations'], plain[3]['iterations'])
+        self.assertTrue(np.isclose(plain[0], fast[0], rtol=1e-6))
+        self.assertTrue(np.isclose(plain[1], fast[1], rtol=1e-6, atol=1e-8))
+        self.assertTrue(np.allclose(plain[2], fast[2], rtol=1e-6))
+        self.assertGreaterEqual(fast[3]['loglik'] + 1e-9, plain[3]['loglik'])
+
+    def test_monotone(self):
+        ''' no SQUAREM cycle lowers the objective '''
+        emstep, loglik = pp.make_engine(self.store, 60)
+        omega, theta, mu = 1.0, 1.0, np.ones(len(self.store))
+        last = loglik(mu, theta, omega)
+        for i in range(10):
+            omega, theta, mu, steps = pp.squarem_step(emstep, loglik,
+                                                      omega, theta, mu)
+            now = loglik(mu, theta, omega)
+            self.assertGreaterEqual(now, last - 1e-9)
+            last = now
+
+    def test_max_iter(self):
+        for accelerate in [False, True]:
+            results = self._fit(accelerate=accelerate, max_iter=4,
+                                tol1=0, tol2=0, tol3=0)
+            self.assertLessEqual(results[3]['iterations'], 4)
+            self.assertFalse(results[3]['converged'])
+
+
+class PredpolTestRates(PredpolPackedFrame):
+    def test_calc_rates(self):
+        ''' one pass over all bins gives lambdafun's rate for each '''
+        mu = np.linspace(0.1, 1, len(self.store))
+        pred_date = pd.datetime(2012, 3, 1)
+        rates = pp.calc_rates(self.store, mu, 0.5, 0.2,
+                              es.to_days([pred_date])[0])
+        for b, n in enumerate(self.data):
+            expected = pp.lambdafun(self.data[n] + [pred_date],
+                                    mu[b], 0.5, 0.2)
+            self.assertAlmostEqual(expected, rates[b])
+        # several prediction days at once, one column each
+        days = es.to_days([pred_date + pd.DateOffset(i) for i in range(3)])
+        several = pp.calc_rates(self.store, mu, 0.5, 0.2, days)
+        self.assertEqual((len(self.store), 3), several.shape)
+        self.assertTrue(np.allclose(rates, several[:, 0]))
+        self.assertTrue(np.all(np.diff(several, axis=1) < 0))
+
+    def test_top_k(self):
+        ''' same order as a full sort, ties included '''
+        rates = np.random.randint(5, size=40).astype(float)
+        keys = np.random.permutation(40)
+        expected = [key for (rate, key)
+                    in sorted(zip(rates, keys), reverse=True)]
+        for k in [1, 7, 20, 40, 50]:
+            self.assertEqual(expected[:k], pp.top_k(rates, keys, k))
+
+    def test_input_untouched(self):
+        before = copy.deepcopy(self.data)
+        pp.runEM(self.data, 60, pd.datetime(2012, 3, 1))
+        self.assertEqual(before, self.data)
+
+
+class PredpolTestBatch(unittest.TestCase):
+    ''' fitting datasets together is fitting each one alone '''
+    def setUp(self):
+        self.stores = []
+        for size in [3, 8, 15, 30]:
+            bins = np.random.randint(size, size=size * 6)
+            days = np.random.randint(90, size=size * 6)
+            # t and some follow-ups, so theta isn't 0 everywhere
+            self.stores.append(es.EventStore.from_arrays(
+                np.concatenate([bins, bins[:size]]),
+                np.concatenate([days, days[:size] + 1])))
+
+    def test_same_as_alone(self):
+        for engine in ['matrix', 'recursive']:
+            omega, theta, mu, info = pp.fitEM_batch(self.stores, 91,
+                                                    engine=engine)
+            for d, store in enumerate(self.stores):
+                alone = pp.fitEM(store, 91, 1.0, 1.0, np.ones(len(store)),
+                                 engine=engine)
+                self.assertTrue(np.isclose(alone[0], omega[d]))
+                self.assertTrue(np.isclose(alone[1], theta[d]))
+                self.assertTrue(np.allclose(alone[2], mu[d]))
+                self.assertEqual(alone[3]['iterations'],
+                                 info[d]['iterations'])
+                self.assertEqual(alone[3]['converged'], info[d]['converged'])
+
+    def test_max_iter(self):
+        _, _, _, info = pp.fitEM_batch(self.stores, 91, max_iter=2)
+        self.assertEqual([2] * 4, [i['iterations'] for i in info])
+
+    def test_runEM_batch(self):
+        # t the day after the last one, 1970-04-01 as a date
+        pred = np.datetime64(91, 'D')
+        out = pp.runEM_batch(self.stores, 91, pred, k=5)
+        for store, (rates, tops, omega, theta) in zip(self.stores, out):
+            expected = pp.runEM(store, 91, pred, k=5)
+            self.assertTrue(np.allclose(expected[0], rates))
+            self.assertEqual(expected[1], tops)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the replicate runner
+
+import unittest
+import numpy as np
+import replicates as rep
+from test_simulation import SimulationFrame
+
+
+class ReplicatesTest(SimulationFrame):
+    num_events = 600
+
+    def setUp(self):
+        super().setUp()
+        # t as eventcache.load_events gives them
+        self.bins = self.bins.astype(np.int32)
+        self.days = self.days.astype(np.int32)
+        self.config = dict(max_bin=30, global_start=self.global_start,
+                           global_end=self.global_end,
+                           predpol_window=40, begin_predpol=0,
+                           percent_increase=0.5)
+
+    def test_reproducible(self):
+        ''' the same root seed gives the same summaries on any pool size '''
+        one = rep.run_replicates(self.bins, self.days, self.config,
+                                 replicates=3, seed=7, processes=1)
+        two = rep.run_replicates(self.bins, self.days, self.config,
+                                 replicates=3, seed=7, processes=2)
+        for name in one:
+            self.assertTrue(np.array_equal(one[name], two[name]), name)
+        self.assertEqual((3, 31), one['targeted'].shape)
+        self.assertEqual((30, 19), one['mean_rates'].shape)
+        # every replicate adds crimes of its own
+        self.assertFalse(np.array_equal(one['observed'][0],
+                                        one['observed'][1]))
+
+    def test_batched(self):
+        ''' the batched runs give summaries of the same shapes and dates as
+            the pool's, and the same ones again from the same seed
+        '''
+        pool = rep.run_replicates(self.bins, self.days, self.config,
+                                  replicates=3, seed=7, processes=1)
+        batched = rep.run_batched(self.bins, self.days, self.config,
+                                  replicates=3, seed=7)
+        for name in pool:
+            self.assertEqual(pool[name].shape, batched[name].shape, name)
+        self.assertTrue(np.array_equal(pool['dates'], batched['dates']))
+        again = rep.run_batched(self.bins, self.days, self.config,
+                                replicates=3, seed=7)
+        for name in batched:
+            self.assertTrue(np.array_equal(batched[name], again[name]), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the simulation's outputs
+
+import io
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import eventstore as es
+import apply_predpol as ap
+from simulation import Simulation
+
+
+class SimulationFrame(unittest.TestCase):
+    ''' seeded random events in bins 1..max_bin over num_days days from
+        global_start; first is global_start's day number
+    '''
+    max_bin = 30
+    num_days = 60
+    num_events = 800
+
+    def setUp(self):
+        self.global_start = pd.Timestamp(2012, 1, 1)
+        self.global_end = self.global_start + pd.DateOffset(self.num_days - 1)
+        self.first = es.to_days([self.global_start])[0]
+        rng = np.random.RandomState(5)
+        self.bins = rng.randint(1, self.max_bin + 1, size=self.num_events)
+        self.days = self.first + rng.randint(self.num_days,
+                                             size=self.num_events)
+
+
+class SimulationResultsTest(SimulationFrame):
+    max_bin = 20
+    num_days = 45
+    num_events = 400
+
+    def simulation(self):
+        return Simulation(self.bins, self.days, 20, self.global_start,
+                          self.global_end, 30, verbose=False)
+
+    def test_partial_results(self):
+        ''' results() part way through is the start of the full results '''
+        partial = self.simulation().run(until=6).results()
+        full = self.simulation().run().results()
+        self.assertEqual((20, 6), partial['rates'].shape)
+        self.assertEqual((20, 14), full['rates'].shape)
+        self.assertEqual('2012-01-31', full['rates'].columns[0])
+        for name in ['rates', 'observed']:
+            self.assertTrue(full[name].iloc[:, :6].equals(partial[name]))
+
+    def test_log(self):
+        ''' one json line per day, with every phase timed '''
+        log = io.StringIO()
+        sim = Simulation(self.bins, self.days, 20, self.global_start,
+                         self.global_end, 30, verbose=False, log=log)
+        # t a branch doesn't write to the trunk's log
+        sim.run(until=10).branch().run()
+        self.assertEqual(10, len(log.getvalue().splitlines()))
+        sim.run()
+        records = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual(list(range(14)), [r['day'] for r in records])
+        self.assertEqual(sim.dates, [r['date'] for r in records])
+        self.assertEqual(list(sim.iterations),
+                         [r['iterations'] for r in records])
+        for r in records:
+            self.assertEqual({'window', 'setup', 'em', 'predict', 'inject',
+                              'bookkeeping', 'total'}, set(r['seconds']))
+            self.assertTrue(0 < r['events'] <= 400)
+            self.assertTrue(0 < r['bins'] <= 20)
+
+    def test_resume(self):
+        ''' a run saved part way and loaded again ends where one that
+            never stopped does, with the global rng or a Generator
+        '''
+        def feedback(rng):
+            return Simulation(self.bins, self.days, 20, self.global_start,
+                              self.global_end, 30, add_crimes_logical=True,
+                              percent_increase=0.5, rng=rng, verbose=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sim.pkl')
+            for make_rng in [lambda: np.random.default_rng(4),
+                             lambda: np.random.seed(4) or np.random]:
+                expected = feedback(make_rng()).run().results()
+                feedback(make_rng()).run(until=6, checkpoint=path, every=4)
+                np.random.seed(5)
+                sim = Simulation.load(path)
+                self.assertEqual(6, sim.i)
+                resumed = sim.run().results()
+                for name in ['rates', 'observed']:
+                    self.assertTrue(expected[name].equals(resumed[name]))
+                self.assertTrue(np.array_equal(expected['targeted'],
+                                               resumed['targeted']))
+
+    def test_resume_log(self):
+        ''' the days a stopped run logged past its checkpoint aren't
+            logged twice
+        '''
+        log = io.StringIO()
+        sim = Simulation(self.bins, self.days, 20, self.global_start,
+                         self.global_end, 30, verbose=False, log=log)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sim.pkl')
+            sim.run(until=4, checkpoint=path)
+            # t stopped three days after its last checkpoint
+            sim.run(until=7)
+            Simulation.load(path, log=log).run()
+        records = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual(list(range(14)), [r['day'] for r in records])
+
+    def test_resume_other_settings(self):
+        ''' a checkpoint doesn't quietly replace the settings asked for '''
+        def run(percent_increase, path):
+            return ap.run_predpol(
+                self.bins, self.days, 20, self.global_start,
+                self.global_end, 30, add_crimes_logical=True,
+                percent_increase=percent_increase,
+                rng=np.random.default_rng(0), verbose=False,
+                checkpoint=path, resume=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sim.pkl')
+            run(0.5, path)
+            self.assertEqual(14, run(0.5, path)['rates'].shape[1])
+            with self.assertRaises(ValueError):
+                run(0.2, path)
+
+    def test_write_npz(self):
+        ''' the .npz holds the same matrices as the csvs '''
+        results = self.simulation().run().results()
+        with tempfile.TemporaryDirectory() as tmp:
+            predictions = os.path.join(tmp, 'predictions.csv')
+            observed = os.path.join(tmp, 'observed.csv')
+            ap.write_results(results, predictions, observed,
+                             ['csv', 'npz'])
+            for path, name in [(predictions, 'rates'),
+                               (observed, 'observed')]:
+                csv = pd.read_csv(path, index_col=0)
+                npz = np.load(path[:-len('.csv')] + '.npz')
+                self.assertTrue(np.allclose(csv.values, npz['values']))
+                self.assertTrue(np.array_equal(results[name].values,
+                                               npz['values']))
+                self.assertEqual(list(csv.columns), list(npz['dates']))
+                self.assertEqual(list(csv.index), list(npz['bins']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the spatial triggering model
+
+import unittest
+import numpy as np
+import predpol as pp
+import eventstore as es
+import spatial as sp
+
+
+class NeighborGraphTest(unittest.TestCase):
+    def _neighbors(self, graph, b):
+        return sorted(graph.indices[graph.indptr[b]:graph.indptr[b + 1]])
+
+    def test_grid(self):
+        graph = sp.NeighborGraph.from_grid(3, 4)
+        self.assertEqual([1, 4, 5], self._neighbors(graph, 0))
+        self.assertEqual([0, 1, 2, 4, 6, 8, 9, 10], self._neighbors(graph, 5))
+        rook = sp.NeighborGraph.from_grid(3, 4, diagonal=False)
+        self.assertEqual([1, 4, 6, 9], self._neighbors(rook, 5))
+        self.assertEqual([3, 8, 0], list(graph.degree([0, 5, 40])))
+
+    def test_points(self):
+        ''' the cell buckets find what comparing every pair does '''
+        rng = np.random.RandomState(3)
+        x, y = rng.rand(2, 200) * 10
+        bins = np.arange(200) + 1
+        graph = sp.NeighborGraph.from_points(bins, x, y, 0.9)
+        close = np.hypot(x[:, None] - x, y[:, None] - y) <= 0.9
+        for i in range(200):
+            expected = [b for b in bins[close[i]] if b != bins[i]]
+            self.assertEqual(expected, self._neighbors(graph, bins[i]))
+
+
+class SpatialEMTest(unittest.TestCase):
+    def setUp(self):
+        # t a 6x6 raster; every event has offspring in its bin and in the
+        # t bins around it, one or more days later
+        rng = np.random.RandomState(5)
+        self.graph = sp.NeighborGraph.from_grid(6, 6)
+        self.T = 400
+        queue = [(b, d) for b in range(36)
+                 for d in rng.randint(self.T, size=rng.poisson(6))]
+        bins, days = [], []
+        while queue:
+            b, d = queue.pop()
+            bins.append(b)
+            days.append(d)
+            near = self.graph.indices[self.graph.indptr[b]:
+                                      self.graph.indptr[b + 1]]
+            for n, th in [(b, 0.3)] + [(n, 0.06) for n in near]:
+                for _ in range(rng.poisson(th)):
+                    day = d + 1 + rng.geometric(0.5)
+                    if day < self.T:
+                        queue.append((n, day))
+        self.store = es.EventStore.from_arrays(bins, days)
+
+    def test_neighbor_sums(self):
+        ''' the recursive neighbor sums are the sums over every pair '''
+        groups, counts = self.store.day_groups()
+        A, B = pp.calc_decay_sums(groups, counts, 0.3)
+        AN, BN = sp.neighbor_sums(groups, counts, A, B,
+                                  sp.neighbor_lookups(groups, self.graph),
+                                  0.3)
+        bins = np.repeat(self.store.keys, self.store.counts)
+        seg = groups.segment_ids()
+        for g in range(0, groups.num_events, 7):
+            b, d = groups.keys[seg[g]], groups.days[g]
+            near = self.graph.indices[self.graph.indptr[b]:
+                                      self.graph.indptr[b + 1]]
+            lags = d - self.store.days[np.isin(bins, near) &
+                                       (self.store.days < d)]
+            self.assertAlmostEqual(np.sum(np.exp(-0.3 * lags)), AN[g])
+            self.assertAlmostEqual(np.sum(lags * np.exp(-0.3 * lags)), BN[g])
+
+    def test_no_neighbors(self):
+        ''' with no edges it is the recursive engine's fit '''
+        graph = sp.NeighborGraph.from_edges([], [], 36)
+        mu = np.ones(len(self.store))
+        spatial = sp.fitEM(self.store, graph, self.T, 1.0, 0.5, 0.0, mu)
+        plain = pp.fitEM(self.store, self.T, 1.0, 0.5, mu,
+                         engine='recursive')
+        self.assertEqual(plain[0], spatial[0])
+        self.assertEqual(plain[1], spatial[1])
+        self.assertEqual(0.0, spatial[2])
+        self.assertTrue(np.array_equal(plain[2], spatial[3]))
+
+    def test_finds_neighbors(self):
+        ''' triggering between bins shows up in theta_n and the fit '''
+        rates, tops, omega, theta, theta_n, fit = sp.runEM(
+            self.store, self.graph, self.T, np.datetime64(self.T, 'D'),
+            full_output=True)
+        self.assertTrue(0.02 < theta_n < 0.1, theta_n)
+        plain = pp.fitEM(self.store, self.T, 1.0, 1.0,
+                         np.ones(len(self.store)), engine='recursive')
+        self.assertTrue(plain[1] > theta)
+        loglik = sp.make_engine(self.store, self.graph, self.T)[1]
+        self.assertTrue(fit['loglik'] >
+                        loglik(plain[2], plain[1], 0.0, plain[0]))
+
+    def test_rates_of_neighbors(self):
+        ''' bins with no events are rated by their neighbors' events '''
+        graph = sp.NeighborGraph.from_grid(3, 3)
+        store = es.EventStore.from_arrays([0, 0, 8], [3, 7, 5])
+        labels = sp.scored_bins(store, graph)
+        self.assertEqual([0, 1, 3, 4, 5, 7, 8], labels.tolist())
+        self.assertEqual([0, 1, 3, 4, 8],
+                         sp.scored_bins(store, graph, max_bin=4).tolist())
+        mu = np.array([0.2, 0.1])
+        rates = sp.calc_rates(store, graph, mu, 0.5, 0.25, 0.4, 10, labels)
+        own = np.exp(-0.4 * np.array([7, 3]))
+        self.assertTrue(np.allclose(
+            rates[labels == 1], 0.25 * 0.4 * own.sum()))
+        self.assertTrue(np.allclose(
+            rates[labels == 4], 0.25 * 0.4 * (own.sum() + np.exp(-2))))
+        self.assertTrue(np.allclose(
+            rates[labels == 0], 0.2 + 0.5 * 0.4 * own.sum()))
+        # t without labels, the bins of store, as before
+        self.assertTrue(np.allclose(
+            rates[np.isin(labels, store.keys)],
+            sp.calc_rates(store, graph, mu, 0.5, 0.25, 0.4, 10)))
+        fit = sp.runEM(store, graph, 10, np.datetime64(10, 'D'), k=9,
+                       full_output=True)[-1]
+        self.assertEqual(labels.tolist(), fit['bins'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- mode: python; fill-column: 79; comment-column: 50 -*-
+
+# Unit Testing for the parameter sweep
+
+import unittest
+import numpy as np
+from simulation import Simulation
+import sweep
+from test_simulation import SimulationFrame
+
+
+class SweepTest(SimulationFrame):
+    num_events = 600
+
+    def test_branches_match_solo_runs(self):
+        ''' branching off the shared prefix changes nothing '''
+        configs = [dict(predpol_window=w, begin_predpol=b, percent_increase=p)
+                   for w in [30, 40] for b in [0, 5] for p in [0.0, 0.5]]
+        results = sweep.sweep(self.bins, self.days, 30, self.global_start,
+                              self.global_end, configs, seed=3, processes=2)
+        children = np.random.SeedSequence(3).spawn(len(configs))
+        for j, config in enumerate(configs):
+            solo = Simulation(
+                self.bins, self.days, 30, self.global_start, self.global_end,
+                config['predpol_window'], config['begin_predpol'],
+                add_crimes_logical=True,
+                percent_increase=config['percent_increase'],
+                rng=np.random.default_rng(children[j]), verbose=False)
+            expected = solo.run().results()
+            for name in ['rates', 'observed']:
+                self.assertTrue(expected[name].equals(results[j][name]),
+                                '{} {}'.format(name, config))
+
+
+if __name__ == '__main__':
+    unittest.main()